@@ -7,5 +7,14 @@ admin.site.register(DataFormat)
 admin.site.register(CardFormat)
 admin.site.register(Data)
 admin.site.register(Card)
+admin.site.register(RenderedCard)
 admin.site.register(Field)
 admin.site.register(FieldValue)
+admin.site.register(Job)
+
+
+@admin.register(ScrapeResult)
+class ScrapeResultAdmin(admin.ModelAdmin):
+    list_display = ('url', 'hits', 'misses', 'created', 'last_used')
+    search_fields = ('url',)
+    ordering = ('-last_used',)
@@ -0,0 +1,120 @@
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+
+
+default_size = 2
+default_max_pages = 100
+default_page_timeout = 30
+default_checkout_timeout = 60
+
+
+def create_driver(page_timeout):
+    from selenium import webdriver
+    from selenium.webdriver.firefox.options import Options
+
+    options = Options()
+    options.add_argument('--headless')
+    driver = webdriver.Firefox(options=options)
+    driver.set_page_load_timeout(page_timeout)
+    return driver
+
+
+class BrowserPool:
+    # A fixed number of long-lived headless browsers, each replaced after max_pages pages or when it stops responding.
+    def __init__(self, size, max_pages, page_timeout, factory=create_driver):
+        self.size = size
+        self.max_pages = max_pages
+        self.page_timeout = page_timeout
+        self.factory = factory
+        self.available = queue.LifoQueue()
+        self.pages = dict()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def create(self):
+        driver = self.factory(self.page_timeout)
+        self.pages[id(driver)] = 0
+        return driver
+
+    def discard(self, driver):
+        self.pages.pop(id(driver), None)
+        with self.lock:
+            self.created -= 1
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def is_healthy(self, driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def checkout(self, timeout=default_checkout_timeout):
+        try:
+            driver = self.available.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_create = self.created < self.size
+                if can_create:
+                    self.created += 1
+            if can_create:
+                try:
+                    return self.create()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            driver = self.available.get(timeout=timeout)
+        if not self.is_healthy(driver):
+            self.discard(driver)
+            return self.checkout(timeout)
+        return driver
+
+    def checkin(self, driver, healthy=True):
+        if not healthy or self.pages.get(id(driver), 0) >= self.max_pages:
+            self.discard(driver)
+        else:
+            self.available.put(driver)
+
+    @contextmanager
+    def page(self, url):
+        driver = self.checkout()
+        healthy = False
+        try:
+            self.pages[id(driver)] += 1
+            driver.get(url)
+            healthy = True
+            yield driver
+        except Exception:
+            # A failed page load quits the browser, but errors from reading the page, such as a missing element,
+            # only do if the browser stopped responding.
+            healthy = healthy and self.is_healthy(driver)
+            raise
+        finally:
+            self.checkin(driver, healthy)
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self.available.get_nowait())
+            except queue.Empty:
+                break
+
+
+@lru_cache(maxsize=None)
+def get_browser_pool():
+    pool = BrowserPool(
+        getattr(settings, 'SCRAPER_BROWSERS', default_size),
+        getattr(settings, 'SCRAPER_MAX_PAGES', default_max_pages),
+        getattr(settings, 'SCRAPER_PAGE_TIMEOUT', default_page_timeout),
+    )
+    atexit.register(pool.close)
+    return pool
@@ -0,0 +1,152 @@
+import gzip
+import io
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+
+format_version = 1
+default_chunk_size = 2000
+
+# Record types in the order they are written, so every reference points at a record that came before it.
+# Each entry is the type, its model name, the lookup of its owner, the exported columns and the references
+# remapped on import.
+record_types = [
+    ('deck', 'Deck', 'user', ['id', 'name'], {}),
+    ('data_format', 'DataFormat', 'user', ['id', 'name', 'url', 'scrape_backend'], {}),
+    ('field', 'Field', 'data_format__user', ['id', 'name', 'data_format_id', 'xpath'],
+     {'data_format_id': 'data_format'}),
+    ('card_format', 'CardFormat', 'user',
+     ['id', 'name', 'question_html', 'answer_html', 'validation_mode', 'data_format_id', 'default_deck_id'],
+     {'data_format_id': 'data_format', 'default_deck_id': 'deck'}),
+    ('data', 'Data', 'user', ['id', 'name', 'format_id'], {'format_id': 'data_format'}),
+    ('field_value', 'FieldValue', 'parent__user', ['field_id', 'parent_id', 'value'],
+     {'field_id': 'field', 'parent_id': 'data'}),
+    ('card', 'Card', 'user',
+     ['id', 'deck_id', 'format_id', 'data_id', 'last_seen', 'last_correct', 'next_due', 'total_correct',
+      'total_wrong', 'current_streak'],
+     {'deck_id': 'deck', 'format_id': 'card_format', 'data_id': 'data'}),
+]
+
+
+class CollectionImportError(ValueError):
+    pass
+
+
+def get_model(model_name):
+    from django.apps import apps
+    return apps.get_model('flash_cards_api', model_name)
+
+
+def export_collection(user, chunk_size=default_chunk_size):
+    # Yields the collection of the user as lines of JSON, reading rows as tuples a chunk at a time so memory
+    # use does not grow with the size of the collection.
+    encoder = DjangoJSONEncoder()
+    yield encoder.encode({'type': 'collection', 'version': format_version}) + '\n'
+    for record_type, model_name, owner, columns, references in record_types:
+        rows = get_model(model_name).objects.filter(**{owner: user}).order_by('pk').values_list(*columns)
+        for row in rows.iterator(chunk_size=chunk_size):
+            record = dict(zip(columns, row))
+            record['type'] = record_type
+            yield encoder.encode(record) + '\n'
+
+
+def compress(lines):
+    # Gzips an iterator of lines as it is consumed.
+    compressor = zlib.compressobj(wbits=31)
+    for line in lines:
+        data = compressor.compress(line.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def read_lines(file):
+    # Yields the text lines of an uploaded export, which may be gzipped.
+    stream = getattr(file, 'file', file)
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+    yield from io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def get_required_columns(model, columns):
+    # Columns that cannot be left out of a record, ids because references are remapped through them.
+    required = []
+    for column in columns:
+        field = model._meta.get_field(column)
+        if column == 'id' or not (field.null or field.has_default()):
+            required.append(column)
+    return required
+
+
+def import_collection(user, lines, chunk_size=default_chunk_size):
+    # Restores an export into the collection of the user in one transaction. Records get new ids, and references
+    # are remapped through the ids given to the records they point at. Returns the number of records per type.
+    from flash_cards_api.models import Card, render_card_set
+
+    types = {record_type: (model_name, owner, columns, references)
+             for record_type, model_name, owner, columns, references in record_types}
+    id_maps = {record_type: dict() for record_type in types}
+    counts = {record_type: 0 for record_type in types}
+    chunk = []
+    chunk_type = None
+
+    def flush():
+        model_name, owner, columns, references = types[chunk_type]
+        model = get_model(model_name)
+        required = get_required_columns(model, columns)
+        objects = []
+        for line_number, record in chunk:
+            missing = [column for column in required if record.get(column) is None]
+            if missing:
+                raise CollectionImportError(f'Line {line_number}: missing {", ".join(missing)}')
+            values = {column: record[column] for column in columns if column != 'id' and column in record}
+            for column, referenced_type in references.items():
+                if values.get(column) is None:
+                    continue
+                try:
+                    values[column] = id_maps[referenced_type][values[column]]
+                except KeyError:
+                    raise CollectionImportError(f'Line {line_number}: unknown {referenced_type} {values[column]}')
+            if owner == 'user':
+                values['user'] = user
+            objects.append(model(**values))
+        try:
+            model.objects.bulk_create(objects)
+        except (IntegrityError, ValidationError, TypeError, ValueError) as e:
+            raise CollectionImportError(f'Lines {chunk[0][0]}-{chunk[-1][0]}: {e}')
+        if 'id' in columns:
+            for (line_number, record), instance in zip(chunk, objects):
+                id_maps[chunk_type][record['id']] = instance.pk
+        counts[chunk_type] += len(objects)
+        chunk.clear()
+
+    with transaction.atomic():
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                record_type = record['type']
+            except (ValueError, TypeError, KeyError):
+                raise CollectionImportError(f'Line {line_number}: not a record')
+            if record_type == 'collection':
+                if record.get('version') != format_version:
+                    raise CollectionImportError(f'Unsupported export version {record.get("version")}')
+                continue
+            if record_type not in types:
+                raise CollectionImportError(f'Line {line_number}: unknown record type {record_type}')
+            if chunk and (record_type != chunk_type or len(chunk) >= chunk_size):
+                flush()
+            chunk_type = record_type
+            chunk.append((line_number, record))
+        if chunk:
+            flush()
+        # The imported cards are the ones of the user without a rendered card.
+        render_card_set(Card.objects.filter(user=user, rendered__isnull=True), chunk_size)
+    return counts
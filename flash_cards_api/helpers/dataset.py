@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+image_shape = (64, 64, 3)
+min_files_per_class = 21
+file_index_name = '.file_index.json'
+
+
+def scan_class(entry_path):
+    with os.scandir(entry_path) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file())
+
+
+def list_files(path, workers=None):
+    # Returns the image files under path and the code point of each, read from the name of its directory.
+    # Listings are cached in a file index in path and only directories whose mtime changed are rescanned.
+    index_path = os.path.join(path, file_index_name)
+    previous = dict()
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            previous = json.loads(file.read())
+    with os.scandir(path) as entries:
+        class_dirs = {entry.name: entry.stat().st_mtime for entry in entries if entry.is_dir()}
+    stale = [name for name, mtime in class_dirs.items() if previous.get(name, {}).get('mtime') != mtime]
+    index = {name: previous[name] for name in class_dirs if name not in stale}
+    if stale:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, files in zip(stale, executor.map(scan_class, [os.path.join(path, name) for name in stale])):
+                index[name] = {'mtime': class_dirs[name], 'files': files}
+        try:
+            with open(index_path, 'w') as file:
+                file.write(json.dumps(index))
+        except OSError:
+            pass
+
+    data = []
+    labels = []
+    for name in sorted(index):
+        files = index[name]['files']
+        if len(files) >= min_files_per_class:
+            label = int(name[-4:], 16)
+            for file in files:
+                data.append(os.path.join(path, name, file))
+                labels.append(label)
+    return data, labels
+
+
+def load_image(file):
+    image = cv2.imread(file)
+    return cv2.resize(image, image_shape[:2])
+
+
+def hash_file(file):
+    with open(file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_paths(output):
+    return (
+        os.path.join(output, 'images.npy'),
+        os.path.join(output, 'labels.npy'),
+        os.path.join(output, 'manifest.json'),
+    )
+
+
+def read_manifest(output):
+    manifest_path = get_paths(output)[2]
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.loads(file.read())
+
+
+def prepare_dataset(path, output, workers=None, incremental=False):
+    # Writes every image under path as uint8 rows of a memory-mapped array, with a label array and a
+    # manifest of file hashes. In incremental mode rows of unchanged files are copied from the last run.
+    os.makedirs(output, exist_ok=True)
+    images_path, labels_path, manifest_path = get_paths(output)
+    files, labels = list_files(path)
+
+    previous = read_manifest(output) if incremental else {}
+    previous_images = np.load(images_path, mmap_mode='r') if previous else None
+    manifest = dict()
+    reused = dict()
+    changed = []
+    for index, file in enumerate(files):
+        stat = os.stat(file)
+        entry = previous.get(file)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            digest = entry['hash']
+        else:
+            digest = hash_file(file)
+        manifest[file] = {'hash': digest, 'size': stat.st_size, 'mtime': stat.st_mtime, 'index': index}
+        if entry and entry['hash'] == digest:
+            reused[index] = entry['index']
+        else:
+            changed.append(index)
+
+    temp_path = images_path + '.tmp'
+    images = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.uint8, shape=(len(files), *image_shape))
+    for index, previous_index in reused.items():
+        images[index] = previous_images[previous_index]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        loaded = executor.map(load_image, [files[index] for index in changed], chunksize=64)
+        for index, image in zip(changed, loaded):
+            images[index] = image
+    images.flush()
+    del images, previous_images
+    os.replace(temp_path, images_path)
+    np.save(labels_path, np.array(labels, dtype=np.int32))
+    with open(manifest_path, 'w') as file:
+        file.write(json.dumps(manifest))
+    return len(changed), len(reused)
+
+
+def open_dataset(output):
+    # Returns the prepared images as a read-only memory map, so batches are read from disk on demand.
+    images_path, labels_path, manifest_path = get_paths(output)
+    return np.load(images_path, mmap_mode='r'), np.load(labels_path)
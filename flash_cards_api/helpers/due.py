@@ -0,0 +1,57 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+
+def get_cache_timeout():
+    return getattr(settings, 'DUE_COUNT_CACHE_TIMEOUT', 0)
+
+
+def get_cache_key(deck_id):
+    # Keys include the date so counters roll over when cards become due at midnight.
+    return f'deck-num-due:{deck_id}:{date.today().isoformat()}'
+
+
+def get_due_counts(decks):
+    # Returns {deck id: number of due cards} for the decks, counting all uncached decks in one query.
+    from flash_cards_api.models import Card
+    deck_ids = [deck.id for deck in decks]
+    counts = dict()
+    timeout = get_cache_timeout()
+    if timeout:
+        cached = cache.get_many([get_cache_key(deck_id) for deck_id in deck_ids])
+        for deck_id in deck_ids:
+            if get_cache_key(deck_id) in cached:
+                counts[deck_id] = cached[get_cache_key(deck_id)]
+    missing = [deck_id for deck_id in deck_ids if deck_id not in counts]
+    if missing:
+        fresh = {deck_id: 0 for deck_id in missing}
+        user_ids = {deck.user_id for deck in decks}
+        rows = Card.objects.filter(user_id__in=user_ids, deck_id__in=missing, next_due__lte=date.today()) \
+            .values('deck_id').annotate(num_due=Count('id')).order_by()
+        for row in rows:
+            fresh[row['deck_id']] = row['num_due']
+        if timeout:
+            cache.set_many({get_cache_key(deck_id): count for deck_id, count in fresh.items()}, timeout)
+        counts.update(fresh)
+    return counts
+
+
+def bump_due_count(deck_id, delta):
+    if not get_cache_timeout() or not deck_id or not delta:
+        return
+    try:
+        cache.incr(get_cache_key(deck_id), delta)
+    except ValueError:
+        pass
+
+
+def clear_due_counts(*deck_ids):
+    # Counts are cleared once the surrounding transaction commits, as a count read before then would be cached
+    # from the old cards.
+    if get_cache_timeout():
+        keys = [get_cache_key(deck_id) for deck_id in deck_ids if deck_id]
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,48 @@
+import html as entities
+import re
+import unicodedata
+from functools import lru_cache
+from html.parser import HTMLParser
+
+
+default_cache_size = 4096
+
+whitespace = re.compile(r'\s+')
+# A start or end tag, allowing quoted attribute values that contain angle brackets.
+tag = re.compile(r'</?[a-zA-Z][^<>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^<>"\']*)*>')
+# Markup the parser treats specially, such as comments and the raw text of scripts and styles.
+special_markup = re.compile(r'<[!?]|<(?:script|style)\b', re.IGNORECASE)
+
+
+class TextExtractor(HTMLParser):
+    # Collects the text of a document, with character references already decoded by HTMLParser.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+
+@lru_cache(maxsize=default_cache_size)
+def get_text(html):
+    # Returns the text of rendered html. Answers are extracted on every render and compared on every check, so
+    # results are cached, and plain tags are stripped with a compiled pattern instead of running the parser.
+    if '<' not in html and '&' not in html:
+        return html
+    if not special_markup.search(html):
+        # Text between tags is unescaped piece by piece, as the parser does not join references across tags.
+        # A '<' that does not start a tag is malformed markup, which only the parser recovers from the same way.
+        parts = tag.split(html)
+        if html.count('<') == len(parts) - 1:
+            return ''.join(entities.unescape(part) for part in parts)
+    extractor = TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ''.join(extractor.parts)
+
+
+@lru_cache(maxsize=default_cache_size)
+def normalize_text(text):
+    # Folds the differences that should not make a typed answer wrong: unicode forms, case and whitespace.
+    return whitespace.sub(' ', unicodedata.normalize('NFKC', text).casefold()).strip()
@@ -0,0 +1,61 @@
+from functools import lru_cache
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+
+default_timeout = 10
+default_pool_size = 10
+link_attributes = ('href', 'src', 'action')
+
+
+class MissingElement(LookupError):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    pool_size = getattr(settings, 'SCRAPER_HTTP_POOL_SIZE', default_pool_size)
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+    return session
+
+
+def get_values(url, html, xpaths):
+    # Evaluates every xpath against one parse of the page, following the trailing @attribute convention
+    # of selenium.get_value. Raises MissingElement when an xpath matches nothing.
+    import lxml.html
+
+    document = lxml.html.fromstring(html)
+    values = dict()
+    for xpath in xpaths:
+        split = xpath.split('/')
+        attribute = ''
+        path = xpath
+        if split[-1].startswith('@'):
+            path = '/'.join(split[0:-1])
+            attribute = split[-1].replace('@', '')
+        elements = document.xpath(path)
+        if not elements:
+            raise MissingElement(xpath)
+        element = elements[0]
+        if attribute:
+            value = element.get(attribute)
+            # Browsers report links as absolute URLs.
+            if value is not None and attribute in link_attributes:
+                value = urljoin(url, value)
+            values[xpath] = value
+        else:
+            values[xpath] = lxml.html.tostring(element, encoding='unicode', with_tail=False)
+    return values
+
+
+def scrape(url, fields):
+    response = get_session().get(url, timeout=getattr(settings, 'SCRAPER_HTTP_TIMEOUT', default_timeout))
+    response.raise_for_status()
+    values = get_values(url, response.text, {field.xpath for field in fields})
+    return {field: values[field.xpath] for field in fields}
@@ -0,0 +1,147 @@
+import csv
+import io
+
+from django.conf import settings
+from django.db import transaction
+
+from flash_cards_api.helpers import jobs, scrape_cache
+from flash_cards_api.helpers.due import clear_due_counts
+
+
+default_chunk_size = 1000
+max_reported_errors = 100
+name_column = 'name'
+
+
+class DataImportError(ValueError):
+    pass
+
+
+def read_csv(file, delimiter=','):
+    # Returns the header of an uploaded CSV or TSV file and an iterator of {column: value} dicts for its lines,
+    # which reads the file a line at a time.
+    # Files that are not UTF-8 or not valid CSV raise DataImportError, at the header or at the line that fails.
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text, delimiter=delimiter)
+    try:
+        columns = reader.fieldnames or []
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise DataImportError(f'Could not read the header: {e}')
+
+    def rows():
+        try:
+            yield from reader
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise DataImportError(f'Could not read line {reader.line_num + 1}: {e}')
+        finally:
+            text.detach()
+    return columns, rows()
+
+
+def get_delimiter(file):
+    name = getattr(file, 'name', '') or ''
+    content_type = getattr(file, 'content_type', '') or ''
+    if name.lower().endswith('.tsv') or content_type == 'text/tab-separated-values':
+        return '\t'
+    return ','
+
+
+def validate_columns(columns, field_names):
+    unknown = [column for column in columns if column != name_column and column not in field_names]
+    if unknown:
+        raise DataImportError(f'Unknown fields: {", ".join(unknown)}')
+
+
+def validate_row(row, field_names, max_name_length):
+    if not isinstance(row, dict):
+        return ['Row must be an object of field names to values.']
+    errors = []
+    if None in row:
+        errors.append('Row has more values than there are columns.')
+    unknown = [column for column in row if column is not None and column != name_column and column not in field_names]
+    if unknown:
+        errors.append(f'Unknown fields: {", ".join(str(column) for column in unknown)}')
+    name = row.get(name_column)
+    if not name:
+        errors.append('Name is required.')
+    elif len(str(name)) > max_name_length:
+        errors.append(f'Name must be at most {max_name_length} characters.')
+    return errors
+
+
+def get_scrape_url(data_format, values):
+    # Returns the URL a data with these {field: value} is scraped from, or None when it names a missing field.
+    try:
+        return data_format.url.format(**{field.name: value for field, value in values.items()})
+    except (KeyError, IndexError):
+        return None
+
+
+def import_data(data_format, user, rows, columns=None, chunk_size=default_chunk_size):
+    # Creates a data per valid row, with its field values and the cards of every card format of the data format,
+    # using chunked bulk inserts in one transaction. Invalid rows are skipped and reported by their row number.
+    # Scraped fields are filled from the scrape cache, and the data whose pages are not cached get one scrape job
+    # per chunk.
+    from flash_cards_api.models import Card, Data, FieldValue, render_cards
+
+    fields = {field.name: field for field in data_format.field_set.all()}
+    manual_fields = [field for field in fields.values() if not field.xpath]
+    scrape_fields = [field for field in fields.values() if field.xpath] if data_format.url else []
+    if columns is not None:
+        validate_columns(columns, fields)
+    card_formats = list(data_format.cardformat_set.all())
+    max_name_length = Data._meta.get_field('name').max_length
+    report = {'created': 0, 'failed': 0, 'errors': [], 'scrape_jobs': 0, 'scrape_cached': 0}
+
+    def flush(chunk):
+        data_set = Data.objects.bulk_create([
+            Data(name=str(row[name_column]), format=data_format, user=user) for row in chunk
+        ])
+        values_set = [
+            {
+                field: None if row.get(field.name) is None else str(row[field.name])
+                for field in {*manual_fields, *(fields[column] for column in row if column in fields)}
+            }
+            for row in chunk
+        ]
+        urls = [get_scrape_url(data_format, values) if scrape_fields else None for values in values_set]
+        cached = scrape_cache.get_values_many([url for url in urls if url is not None], scrape_fields)
+        field_values = []
+        for data, values, url in zip(data_set, values_set, urls):
+            values.update(cached.get(url, {}))
+            instances = [FieldValue(field=field, parent=data, value=value) for field, value in values.items()]
+            # Cards are rendered from these instances rather than prefetching the values that were just written.
+            data._prefetched_objects_cache = {'field_value_set': instances}
+            field_values.extend(instances)
+        FieldValue.objects.bulk_create(field_values)
+        cards = Card.objects.bulk_create([
+            Card(format=card_format, data=data, deck_id=card_format.default_deck_id, user=user)
+            for data in data_set for card_format in card_formats
+        ])
+        render_cards(cards)
+        if scrape_fields:
+            data_ids = [data.id for data, url in zip(data_set, urls) if url not in cached]
+            if data_ids:
+                jobs.enqueue('scrape_data_set', user, max_attempts=getattr(settings, 'SCRAPE_MAX_ATTEMPTS', 3),
+                             data_ids=data_ids)
+                report['scrape_jobs'] += 1
+            report['scrape_cached'] += len(data_set) - len(data_ids)
+        report['created'] += len(chunk)
+
+    with transaction.atomic():
+        clear_due_counts(*{card_format.default_deck_id for card_format in card_formats})
+        chunk = []
+        for index, row in enumerate(rows, start=1):
+            errors = validate_row(row, fields, max_name_length)
+            if errors:
+                report['failed'] += 1
+                if len(report['errors']) < max_reported_errors:
+                    report['errors'].append({'row': index, 'errors': errors})
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    return report
@@ -0,0 +1,108 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+default_num_workers = 1
+default_retry_delay = 5
+default_timeout = 60 * 60
+
+handlers = dict()
+_executor = None
+_lock = threading.Lock()
+
+
+def register(kind):
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'JOB_WORKERS', default_num_workers))
+    return _executor
+
+
+def enqueue(kind, user, max_attempts=1, **payload):
+    # Saves a job and hands it to the background workers once the surrounding transaction commits.
+    from flash_cards_api.models import Job
+    job = Job.objects.create(kind=kind, user=user, payload=payload, max_attempts=max_attempts)
+    transaction.on_commit(lambda: get_executor().submit(run_job, job.id))
+    return job
+
+
+def schedule_retry(job):
+    # Failed attempts are retried with exponential backoff, doubling the delay each time.
+    delay = getattr(settings, 'JOB_RETRY_DELAY', default_retry_delay) * 2 ** (job.attempts - 1)
+    job.status = job.PENDING
+    job.run_after = timezone.now() + timedelta(seconds=delay)
+    job.save()
+    timer = threading.Timer(delay, lambda: get_executor().submit(run_job, job.id))
+    timer.daemon = True
+    timer.start()
+
+
+def run_job(job_id):
+    from flash_cards_api.models import Job
+    close_old_connections()
+    try:
+        claimed = Job.objects.filter(id=job_id, status=Job.PENDING) \
+            .filter(Q(run_after__isnull=True) | Q(run_after__lte=timezone.now())) \
+            .update(status=Job.RUNNING, attempts=F('attempts') + 1, updated=timezone.now())
+        if not claimed:
+            return
+        job = Job.objects.get(id=job_id)
+        try:
+            job.result = handlers[job.kind](**job.payload)
+            job.status = Job.DONE
+            job.error = ''
+        except Exception as e:
+            logger.exception(f'Job {job.id} ({job.kind}) failed on attempt {job.attempts}')
+            job.error = str(e)
+            if job.attempts < job.max_attempts:
+                schedule_retry(job)
+                return
+            job.status = Job.FAILED
+        job.save()
+    finally:
+        close_old_connections()
+
+
+def release_stale_jobs():
+    # Jobs still running after JOB_TIMEOUT seconds were left behind by a worker that stopped. They are retried if
+    # they have attempts left and failed otherwise.
+    from flash_cards_api.models import Job
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        updated__lt=now - timedelta(seconds=getattr(settings, 'JOB_TIMEOUT', default_timeout)),
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')) \
+        .update(status=Job.FAILED, error='The worker stopped while running the job.', updated=now)
+    retried = stale.update(status=Job.PENDING, run_after=None, updated=now)
+    return failed + retried
+
+
+def run_pending():
+    from flash_cards_api.models import Job
+    release_stale_jobs()
+    job_ids = list(
+        Job.objects.filter(status=Job.PENDING)
+        .filter(Q(run_after__isnull=True) | Q(run_after__lte=timezone.now()))
+        .order_by('id').values_list('id', flat=True)
+    )
+    for job_id in job_ids:
+        run_job(job_id)
+    return len(job_ids)
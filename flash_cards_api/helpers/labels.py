@@ -1,18 +1,42 @@
 import json
-from sklearn.preprocessing import LabelEncoder
+from collections import Counter
+from functools import lru_cache
+
+
+label_file = 'labels.json'
 
 
 def write_label_file(labels):
-    with open('labels.json', 'w') as file:
-        file.write(json.dumps(labels))
+    # Stores each class once with its number of samples rather than every sample's label.
+    counts = Counter(labels)
+    classes = sorted(counts)
+    with open(label_file, 'w') as file:
+        file.write(json.dumps({
+            'classes': classes,
+            'counts': [counts[label] for label in classes],
+        }))
+    get_classes.cache_clear()
+    get_label_encoder.cache_clear()
 
 def read_label_file():
-    with open('labels.json', 'r') as file:
+    with open(label_file, 'r') as file:
         labels = (json.loads(file.read()))
-    return labels
+    if isinstance(labels, list):
+        # Older label files list the label of every sample.
+        return sorted(set(labels))
+    return labels['classes']
+
+
+@lru_cache(maxsize=None)
+def get_classes():
+    # The sorted classes, indexed by the model's outputs. Recognition maps outputs with this list instead of the
+    # label encoder, so serving does not import scikit-learn.
+    return read_label_file()
 
 
+@lru_cache(maxsize=None)
 def get_label_encoder():
+    from sklearn.preprocessing import LabelEncoder
     labels = read_label_file()
     le = LabelEncoder()
     le.fit(labels)
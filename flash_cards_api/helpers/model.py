@@ -21,8 +21,8 @@ def construct_model():
     return model
 
 
-def train_model(model, data, labels):
-    return model.fit(data, labels, validation_split=.2, batch_size=16, epochs=20)
+def train_model(model, dataset, validation_data, epochs=20, callbacks=None):
+    return model.fit(dataset, validation_data=validation_data, epochs=epochs, callbacks=callbacks)
 
 
 def load_model():
@@ -32,3 +32,13 @@ def load_model():
 def save_model(model):
     print(f'Saving model to ocr.keras')
     model.save('ocr.keras')
+
+
+def export_tflite(model, samples, path='ocr.tflite'):
+    # Quantizes weights and activations to int8, calibrated on the sample images. Input and output stay float32.
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: ([sample[None]] for sample in samples)
+    print(f'Saving quantized model to {path}')
+    with open(path, 'wb') as file:
+        file.write(converter.convert())
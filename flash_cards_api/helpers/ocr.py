@@ -0,0 +1,172 @@
+import base64
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from flash_cards_api.helpers.labels import get_classes
+
+
+default_max_batch_size = 64
+default_max_batch_delay = 0.005
+default_timeout = 30
+image_size = 64
+min_gap = 3
+
+_model = None
+_batcher = None
+# Reentrant, as the batcher loads the model while holding it.
+_lock = threading.RLock()
+
+
+def decode_image(data):
+    # Returns a grayscale image with dark ink on a white background from a data URL, base64 string or bytes.
+    if isinstance(data, str):
+        if data.startswith('data:'):
+            data = data.split(',', 1)[1]
+        data = base64.b64decode(data)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError('Could not decode image')
+    if image.ndim == 3 and image.shape[2] == 4:
+        # Canvas exports draw strokes on a transparent background.
+        return np.where(image[:, :, 3] > 0, 0, 255).astype(np.uint8)
+    if image.ndim == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def get_runs(mask):
+    # Returns (start, end) pairs of the runs of True values, joining runs separated by less than min_gap.
+    runs = []
+    start = None
+    for i, value in enumerate(mask):
+        if value and start is None:
+            start = i
+        elif not value and start is not None:
+            runs.append([start, i])
+            start = None
+    if start is not None:
+        runs.append([start, len(mask)])
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] < min_gap:
+            merged[-1][1] = run[1]
+        else:
+            merged.append(run)
+    return merged
+
+
+def segment_characters(image):
+    # Splits a line of handwriting into square character crops, shaped like the training images.
+    ink = image < 128
+    crops = []
+    for left, right in get_runs(ink.any(axis=0)):
+        rows = np.flatnonzero(ink[:, left:right].any(axis=1))
+        crop = image[rows[0]:rows[-1] + 1, left:right]
+        height, width = crop.shape
+        side = max(height, width) + 8
+        square = np.full((side, side), 255, dtype=np.uint8)
+        top = (side - height) // 2
+        offset = (side - width) // 2
+        square[top:top + height, offset:offset + width] = crop
+        square = cv2.resize(square, (image_size, image_size), interpolation=cv2.INTER_AREA)
+        crops.append(cv2.cvtColor(square, cv2.COLOR_GRAY2BGR).astype(np.float32) / 255)
+    return crops
+
+
+class Batcher:
+    # Collects character crops from concurrent requests and runs them through the model in one call.
+    def __init__(self, predict, max_batch_size, max_batch_delay):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, crops):
+        future = Future()
+        self.requests.put((crops, future))
+        return future
+
+    def collect(self):
+        items = [self.requests.get()]
+        size = len(items[0][0])
+        deadline = time.monotonic() + self.max_batch_delay
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            size += len(item[0])
+        return items
+
+    def run(self):
+        while True:
+            items = self.collect()
+            try:
+                predictions = self.predict(np.concatenate([crops for crops, future in items]))
+            except Exception as e:
+                for crops, future in items:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for crops, future in items:
+                future.set_result(predictions[start:start + len(crops)])
+                start += len(crops)
+
+
+def load_model():
+    if getattr(settings, 'OCR_BACKEND', 'keras') == 'tflite':
+        from flash_cards_api.helpers.tflite import TFLiteModel
+        return TFLiteModel(getattr(settings, 'OCR_TFLITE_MODEL', 'ocr.tflite'))
+    from flash_cards_api.helpers.model import load_model
+    return load_model()
+
+
+def get_model():
+    # The model is only loaded by the first request that needs it, and only once when requests arrive together.
+    global _model
+    with _lock:
+        if _model is None:
+            _model = load_model()
+    return _model
+
+
+def get_batcher():
+    global _batcher
+    with _lock:
+        if _batcher is None:
+            model = get_model()
+            _batcher = Batcher(
+                lambda batch: model.predict(batch, verbose=0),
+                getattr(settings, 'OCR_MAX_BATCH_SIZE', default_max_batch_size),
+                getattr(settings, 'OCR_MAX_BATCH_DELAY', default_max_batch_delay),
+            )
+    return _batcher
+
+
+def get_results(prediction, classes, num_results):
+    indexes = [index for index in np.argsort(prediction)[::-1] if index < len(classes)][:num_results]
+    return {
+        'labels': [chr(classes[index]) for index in indexes],
+        'accuracy': [float(prediction[index]) for index in indexes],
+    }
+
+
+def recognize(data, num_results):
+    crops = segment_characters(decode_image(data))
+    if not crops:
+        return []
+    predictions = get_batcher().submit(np.stack(crops)).result(timeout=default_timeout)
+    classes = get_classes()
+    return [get_results(prediction, classes, num_results) for prediction in predictions]
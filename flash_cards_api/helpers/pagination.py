@@ -0,0 +1,28 @@
+from rest_framework.pagination import CursorPagination
+
+
+def get_requested_fields(request):
+    # Returns the field names given by ?fields=a,b, or None when every field is wanted.
+    if request is None or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',') if name.strip()}
+
+
+def wants_field(request, *names):
+    requested = get_requested_fields(request)
+    return requested is None or any(name in requested for name in names)
+
+
+class OptionalCursorPagination(CursorPagination):
+    # Pages through lists by id, which is indexed on every table. Lists are only paginated when a cursor or a
+    # page size is passed, so existing clients keep receiving plain arrays.
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and \
+                self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,108 @@
+import math
+
+from django.conf import settings
+
+
+# Intervals are capped so long streaks cannot push next_due past the range of a date.
+default_max_interval = 36500
+# Exponential schedules reach any sensible cap well before this many steps, so larger exponents are not computed.
+max_exponent = 100
+
+
+def get_max_interval():
+    return getattr(settings, 'SCHEDULER_MAX_INTERVAL', default_max_interval)
+
+
+class QuadraticScheduler:
+    # The original rule, the interval grows with the square of the streak scaled by the learning rate.
+    def days(self, streak, learning_rate):
+        return min(math.floor(learning_rate * streak ** 2 + 0.9), get_max_interval())
+
+    def days_array(self, streaks, learning_rate):
+        import numpy as np
+        return np.minimum(np.floor(learning_rate * streaks.astype(np.float64) ** 2 + 0.9), get_max_interval())
+
+
+class SM2Scheduler:
+    # SM-2 with pass/fail grades, 1 day then 6 days then growing by a fixed ease factor.
+    ease = 2.5
+
+    def days(self, streak, learning_rate):
+        if streak <= 0:
+            return 0
+        if streak == 1:
+            return 1
+        return min(round(6 * self.ease ** min(streak - 2, max_exponent)), get_max_interval())
+
+    def days_array(self, streaks, learning_rate):
+        import numpy as np
+        exponents = np.clip(streaks - 2, 0, max_exponent).astype(np.float64)
+        days = np.minimum(np.rint(6 * self.ease ** exponents), get_max_interval())
+        days[streaks == 1] = 1
+        days[streaks <= 0] = 0
+        return days
+
+
+class FSRSScheduler:
+    # FSRS style, stability grows with each correct answer and the interval is chosen so the
+    # predicted recall probability has decayed to the desired retention when the card is next due.
+    initial_stability = 2.4
+    growth = 2.2
+    desired_retention = 0.9
+
+    def days(self, streak, learning_rate):
+        if streak <= 0:
+            return 0
+        stability = self.initial_stability * self.growth ** min(streak - 1, max_exponent)
+        return min(max(1, round(9 * stability * (1 / self.desired_retention - 1))), get_max_interval())
+
+    def days_array(self, streaks, learning_rate):
+        import numpy as np
+        stability = self.initial_stability * self.growth ** np.clip(streaks - 1, 0, max_exponent).astype(np.float64)
+        days = np.minimum(np.maximum(1, np.rint(9 * stability * (1 / self.desired_retention - 1))), get_max_interval())
+        days[streaks <= 0] = 0
+        return days
+
+
+schedulers = {
+    'QUADRATIC': QuadraticScheduler(),
+    'SM2': SM2Scheduler(),
+    'FSRS': FSRSScheduler(),
+}
+
+
+def get_scheduler(name):
+    return schedulers[name]
+
+
+def reschedule_cards(user, chunk_size=5000):
+    # Recomputes next_due for every seen card of the user, a chunk of cards at a time.
+    import numpy as np
+    from flash_cards_api.models import Card
+    from flash_cards_api.helpers.due import clear_due_counts
+    pref = user.pref
+    scheduler = get_scheduler(pref.scheduler)
+    rows = Card.objects.filter(user=user, last_seen__isnull=False).order_by('id') \
+        .values_list('id', 'current_streak', 'last_seen')
+    total = 0
+    chunk = []
+
+    def flush():
+        ids, streaks, last_seen = zip(*chunk)
+        days = scheduler.days_array(np.array(streaks), pref.learning_rate).astype('timedelta64[D]')
+        next_due = np.array([seen.date() for seen in last_seen], dtype='datetime64[D]') + days
+        Card.objects.bulk_update(
+            [Card(id=card_id, next_due=due) for card_id, due in zip(ids, next_due.tolist())],
+            ['next_due'],
+        )
+        return len(chunk)
+
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            total += flush()
+            chunk = []
+    if chunk:
+        total += flush()
+    clear_due_counts(*user.deck_set.values_list('id', flat=True))
+    return total
@@ -0,0 +1,92 @@
+import hashlib
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+
+default_timeout = 7 * 24 * 60 * 60
+default_max_entries = 10000
+
+
+def get_timeout():
+    return getattr(settings, 'SCRAPE_CACHE_TIMEOUT', default_timeout)
+
+
+def get_key(url, xpaths):
+    # Entries are keyed by the resolved URL and the set of xpaths read from it, so formats reading the same
+    # fields from the same page share entries.
+    return hashlib.sha1('\n'.join([url, *sorted(set(xpaths))]).encode()).hexdigest()
+
+
+def get_values(url, fields):
+    # Returns {field: value} from a fresh entry, or None when the page has to be scraped.
+    return get_values_many([url], fields).get(url)
+
+
+def get_values_many(urls, fields):
+    # Returns {url: {field: value}} for the urls with a fresh entry, reading the entries in one query and counting
+    # a hit for every url asked for.
+    from flash_cards_api.models import ScrapeResult
+    timeout = get_timeout()
+    if not timeout or not fields or not urls:
+        return dict()
+    xpaths = [field.xpath for field in fields]
+    keys = Counter(get_key(url, xpaths) for url in urls)
+    now = timezone.now()
+    entries = ScrapeResult.objects.filter(key__in=keys, created__gte=now - timedelta(seconds=timeout)) \
+        .values_list('id', 'key', 'values')
+    values = dict()
+    hits = defaultdict(list)
+    for entry_id, key, entry_values in entries:
+        values[key] = {field: entry_values.get(field.xpath) for field in fields}
+        hits[keys[key]].append(entry_id)
+    for count, entry_ids in hits.items():
+        ScrapeResult.objects.filter(id__in=entry_ids).update(hits=F('hits') + count, last_used=now)
+    return {url: values[get_key(url, xpaths)] for url in urls if get_key(url, xpaths) in values}
+
+
+def store_values(url, values):
+    # Saves the {field: value} result of a scrape, counting it as a miss, then evicts the entries over the limit.
+    from flash_cards_api.models import ScrapeResult
+    if not get_timeout() or not values:
+        return
+    now = timezone.now()
+    key = get_key(url, [field.xpath for field in values])
+    fields = {
+        'url': url,
+        'values': {field.xpath: value for field, value in values.items()},
+        'created': now,
+        'last_used': now,
+    }
+    if not ScrapeResult.objects.filter(key=key).update(misses=F('misses') + 1, **fields):
+        try:
+            ScrapeResult.objects.create(key=key, misses=1, **fields)
+        except IntegrityError:
+            ScrapeResult.objects.filter(key=key).update(misses=F('misses') + 1, **fields)
+    evict()
+
+
+def evict():
+    # Drops expired entries, then the least recently used entries beyond SCRAPE_CACHE_MAX_ENTRIES.
+    from flash_cards_api.models import ScrapeResult
+    ScrapeResult.objects.filter(created__lt=timezone.now() - timedelta(seconds=get_timeout())).delete()
+    max_entries = getattr(settings, 'SCRAPE_CACHE_MAX_ENTRIES', default_max_entries)
+    stale = ScrapeResult.objects.order_by('-last_used').values_list('id', flat=True)[max_entries:]
+    stale_ids = list(stale)
+    if stale_ids:
+        ScrapeResult.objects.filter(id__in=stale_ids).delete()
+
+
+def get_stats():
+    from flash_cards_api.models import ScrapeResult
+    stats = ScrapeResult.objects.aggregate(entries=Count('id'), hits=Sum('hits'), misses=Sum('misses'))
+    return {key: value or 0 for key, value in stats.items()}
+
+
+def clear():
+    from flash_cards_api.models import ScrapeResult
+    return ScrapeResult.objects.all().delete()[0]
@@ -0,0 +1,37 @@
+import logging
+
+from flash_cards_api.helpers import http
+from flash_cards_api.helpers.browser import get_browser_pool
+
+
+logger = logging.getLogger(__name__)
+
+
+def scrape_browser(url, fields):
+    # Selenium is imported on the first browser scrape rather than when Django starts.
+    from flash_cards_api.helpers.selenium import get_value
+
+    with get_browser_pool().page(url) as driver:
+        return {field: get_value(driver, field.xpath) for field in fields}
+
+
+def scrape(url, fields, backend='AUTO'):
+    # Returns {field: value} for fields with an xpath, read from url. AUTO fetches the static page first and
+    # falls back to a browser when an xpath matches nothing, as the content is likely built by JavaScript, or
+    # when the request fails, as sites often refuse clients that are not browsers.
+    from requests import RequestException
+
+    fields = list(fields)
+    if backend == 'BROWSER':
+        return scrape_browser(url, fields)
+    try:
+        return http.scrape(url, fields)
+    except http.MissingElement as e:
+        if backend == 'HTTP':
+            raise
+        logger.info(f'{e} not found in the static page of {url}, using a browser')
+    except RequestException as e:
+        if backend == 'HTTP':
+            raise
+        logger.info(f'Fetching {url} failed ({e}), using a browser')
+    return scrape_browser(url, fields)
@@ -1,4 +1,7 @@
 default_num_results = 5
 
-def submit(data):
-    return None
\ No newline at end of file
+
+def submit(data, num_results=default_num_results):
+    # OpenCV, NumPy and the model are imported on the first submission rather than when Django starts.
+    from flash_cards_api.helpers.ocr import recognize
+    return recognize(data, num_results)
@@ -0,0 +1,43 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.template import Template
+
+
+default_cache_size = 512
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_cache_size():
+    return getattr(settings, 'CARD_TEMPLATE_CACHE_SIZE', default_cache_size)
+
+
+def get_template(card_format, side):
+    # Returns the compiled template for one side of a card format, compiling it at most once per process.
+    html = card_format.question_html if side == 'question' else card_format.answer_html
+    key = (card_format.id, side, hashlib.sha1(html.encode()).hexdigest())
+    with _lock:
+        template = _cache.get(key)
+        if template is not None:
+            _cache.move_to_end(key)
+            return template
+    template = Template(f'{{% autoescape off %}}{html}{{% endautoescape %}}')
+    with _lock:
+        _cache[key] = template
+        _cache.move_to_end(key)
+        while len(_cache) > get_cache_size():
+            _cache.popitem(last=False)
+    return template
+
+
+def clear_template_cache(card_format_id=None):
+    with _lock:
+        if card_format_id is None:
+            _cache.clear()
+            return
+        for key in [key for key in _cache if key[0] == card_format_id]:
+            del _cache[key]
@@ -0,0 +1,39 @@
+import threading
+
+import numpy as np
+
+
+default_model_path = 'ocr.tflite'
+
+
+def get_interpreter_class():
+    # Prefers the standalone runtimes, which load without importing TensorFlow.
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    # Runs the exported OCR model with the same predict() call as the Keras model.
+    def __init__(self, path=default_model_path):
+        self.interpreter = get_interpreter_class()(model_path=path)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+        self.lock = threading.Lock()
+
+    def predict(self, batch, verbose=0):
+        with self.lock:
+            if batch.shape[0] != self.batch_size:
+                self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+                self.interpreter.allocate_tensors()
+                self.batch_size = batch.shape[0]
+            self.interpreter.set_tensor(self.input_index, batch.astype(np.float32))
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
@@ -0,0 +1,28 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from flash_cards_api.helpers.collection import compress, export_collection
+
+
+class Command(BaseCommand):
+    help = 'Writes the decks, formats, data and cards of a user as NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', help='File to write to instead of standard output.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user = User.objects.get(username=options['username'])
+        lines = export_collection(user, chunk_size=options['chunk_size'])
+        chunks = compress(lines) if options['gzip'] else (line.encode() for line in lines)
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,22 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from flash_cards_api.helpers.collection import CollectionImportError, import_collection, read_lines
+
+
+class Command(BaseCommand):
+    help = 'Adds a collection written by export_collection to the collection of a user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('file', help='NDJSON export, optionally gzipped.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        user = User.objects.get(username=options['username'])
+        try:
+            with open(options['file'], 'rb') as file:
+                counts = import_collection(user, read_lines(file), chunk_size=options['chunk_size'])
+        except CollectionImportError as e:
+            raise CommandError(str(e))
+        print(', '.join(f'{count} {record_type}' for record_type, count in counts.items()) + ' imported.')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+import time
+
+from flash_cards_api.helpers.dataset import prepare_dataset
+
+
+class Command(BaseCommand):
+    help = 'Decodes and resizes the training images once into a memory-mapped array for the train command.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('datapath', type=str)
+        parser.add_argument('output', type=str)
+        parser.add_argument('--incremental', action='store_true', help='Only process new or changed files.')
+        parser.add_argument('--workers', type=int, default=None)
+
+    def handle(self, datapath, output, *args, **options):
+        start = time.perf_counter()
+        changed, reused = prepare_dataset(datapath, output, options['workers'], options['incremental'])
+        print(f'Processed {changed} images and reused {reused} in {time.perf_counter() - start:.1f}s.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from flash_cards_api.models import Card, render_card_set
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the stored question and answer of cards.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', type=int, help='Only rebuild cards of this card format.')
+        parser.add_argument('--user', type=int, help='Only rebuild cards of this user.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cards = Card.objects.all()
+        if options['format']:
+            cards = cards.filter(format_id=options['format'])
+        if options['user']:
+            cards = cards.filter(user_id=options['user'])
+        total = cards.count()
+        print(f'Rendering {total} cards.')
+        render_card_set(cards.order_by('id'), chunk_size=options['chunk_size'])
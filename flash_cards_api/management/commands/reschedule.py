@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from flash_cards_api.helpers.schedulers import reschedule_cards
+
+
+class Command(BaseCommand):
+    help = 'Recomputes when cards are next due using each user\'s scheduler and learning rate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only reschedule the cards of this user.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(pref__isnull=False).select_related('pref')
+        if options['user']:
+            users = users.filter(id=options['user'])
+        for user in users:
+            count = reschedule_cards(user, chunk_size=options['chunk_size'])
+            print(f'Rescheduled {count} cards for {user}.')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from flash_cards_api.helpers.jobs import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Runs all pending background jobs, including ones left running or waiting to retry by a restart.'
+
+    def handle(self, *args, **options):
+        count = run_pending()
+        print(f'Ran {count} jobs.')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from flash_cards_api.helpers import scrape_cache
+
+
+class Command(BaseCommand):
+    help = 'Prints the hit and miss counts of the scrape cache, optionally evicting or clearing its entries.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--evict', action='store_true', help='Drop expired and least recently used entries.')
+        parser.add_argument('--clear', action='store_true', help='Drop every entry.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            print(f'Cleared {scrape_cache.clear()} entries.')
+        elif options['evict']:
+            scrape_cache.evict()
+        stats = scrape_cache.get_stats()
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = stats['hits'] / lookups if lookups else 0
+        print(f'{stats["entries"]} entries, {stats["hits"]} hits, {stats["misses"]} misses ({hit_rate:.1%} hit rate).')
@@ -1,72 +1,157 @@
 from django.core.management.base import BaseCommand, CommandError
 
+import time
+
 import numpy as np
-import cv2
-import os
+import tensorflow as tf
 
 from sklearn.utils import shuffle
 
+from flash_cards_api.helpers.dataset import list_files, open_dataset
 from flash_cards_api.helpers.labels import write_label_file, get_label_encoder
-from flash_cards_api.helpers.model import construct_model, train_model, save_model
+from flash_cards_api.helpers.model import construct_model, train_model, save_model, export_tflite
+from flash_cards_api.helpers.tflite import TFLiteModel
+
+
+shuffle_buffer_size = 10000
+num_calibration_samples = 200
 
 
 def get_image(file):
-    image = cv2.imread(file)
-    image = cv2.resize(image, (64, 64))
-    image = np.array(image, dtype=np.float32)
-    image = image / 255
-    return image
+    # Decodes in BGR channel order to match images previously loaded with cv2.imread.
+    image = tf.io.decode_image(tf.io.read_file(file), channels=3, expand_animations=False)
+    image = tf.reverse(image, axis=[-1])
+    image = tf.image.resize(image, (64, 64))
+    return image / 255
 
 
 def get_files(path):
-    data = []
-    labels = []
-    for subdir, dirs, files in os.walk(path):
-        if subdir == path:
-            continue
-        label = int(subdir[-4:], 16)
-        if len(files) > 20:
-            for file in files:
-                image = os.path.join(subdir, file)
-                data.append(image)
-                labels.append(label)
-
+    data, labels = list_files(path)
     write_label_file(labels)
     data_sh, labels_sh = shuffle(data, labels, random_state=42)
 
     return data_sh, labels_sh
 
 
-def get_data(files, labels, start, size):
-    data = list()
-    for file in files[start:start+size]:
-        data.append(get_image(file))
-    data = np.array(data)
-    labels = np.array(labels[start:start+size])
+def get_dataset(files, labels, batch_size, training):
+    dataset = tf.data.Dataset.from_tensor_slices((files, labels))
+    if training:
+        dataset = dataset.shuffle(min(len(files), shuffle_buffer_size), reshuffle_each_iteration=True)
+    dataset = dataset.map(lambda file, label: (get_image(file), label), num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
 
-    le = get_label_encoder()
-    labels = le.transform(labels)
 
-    data_sh, labels_sh = shuffle(data, labels, random_state=42)
-    return data_sh, labels_sh
+class CachedImages(tf.keras.utils.Sequence):
+    # Reads batches from a dataset written by prepare_dataset, converting only the batch to float32.
+    def __init__(self, images, labels, indexes, batch_size, training):
+        super().__init__()
+        self.images = images
+        self.labels = labels
+        self.indexes = indexes
+        self.batch_size = batch_size
+        self.training = training
+        self.on_epoch_end()
+
+    def __len__(self):
+        return (len(self.indexes) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, batch):
+        indexes = np.sort(self.indexes[batch * self.batch_size:(batch + 1) * self.batch_size])
+        return self.images[indexes].astype(np.float32) / 255, self.labels[indexes]
+
+    def on_epoch_end(self):
+        if self.training:
+            np.random.shuffle(self.indexes)
+
+
+class Throughput(tf.keras.callbacks.Callback):
+    def __init__(self, num_images):
+        super().__init__()
+        self.num_images = num_images
+        self.start = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        print(f'Epoch {epoch + 1}: {self.num_images / (time.perf_counter() - self.start):.0f} images/sec.')
+
+
+def get_batches(dataset):
+    if isinstance(dataset, tf.keras.utils.Sequence):
+        return (dataset[i] for i in range(len(dataset)))
+    return dataset.as_numpy_iterator()
+
+
+def get_samples(dataset, count):
+    samples = []
+    for images, labels in get_batches(dataset):
+        samples.extend(images[:count - len(samples)])
+        if len(samples) >= count:
+            break
+    return np.array(samples, dtype=np.float32)
+
+
+def report_accuracy(model, quantized, validation):
+    float_correct = 0
+    quantized_correct = 0
+    total = 0
+    for images, labels in get_batches(validation):
+        float_correct += int((model.predict(images, verbose=0).argmax(axis=1) == labels).sum())
+        quantized_correct += int((quantized.predict(images).argmax(axis=1) == labels).sum())
+        total += len(labels)
+    if total:
+        float_accuracy = float_correct / total
+        quantized_accuracy = quantized_correct / total
+        print(f'Validation accuracy: float {float_accuracy:.4f}, quantized {quantized_accuracy:.4f}, '
+              f'delta {quantized_accuracy - float_accuracy:+.4f}.')
 
 
 class Command(BaseCommand):
     help = ''
 
     def add_arguments(self, parser):
-        parser.add_argument('datapath', type=str)
-        parser.add_argument('chunk-size', type=int)
+        parser.add_argument('datapath', type=str, help='Image directory, or the output of prepare_dataset with --cache.')
+        parser.add_argument('--cache', action='store_true', help='Read images prepared by prepare_dataset.')
+        parser.add_argument('--batch-size', type=int, default=16)
+        parser.add_argument('--epochs', type=int, default=20)
+        parser.add_argument('--validation-split', type=float, default=0.2)
+        parser.add_argument('--skip-export', action='store_true', help='Do not write the quantized ocr.tflite.')
 
     def handle(self, datapath, *args, **options):
-        chunk_size = options.get('chunk-size', None)
-        files, labels = get_files(datapath)
+        if options['cache']:
+            training, validation, split, total = self.get_cached(datapath, options)
+        else:
+            training, validation, split, total = self.get_streamed(datapath, options)
+        print(f'Training on {split} items, validating on {total - split}.')
 
         model = construct_model()
-        index = 0
-        while index < len(labels):
-            data, labels_set = get_data(files, labels, index, chunk_size)
-            print(f'Training on {index + len(data)} items out of {len(labels)}.')
-            history = train_model(model, data, labels_set)
-            index += chunk_size
+        train_model(model, training, validation, options['epochs'], [Throughput(split)])
         save_model(model)
+        if not options['skip_export']:
+            export_tflite(model, get_samples(training, num_calibration_samples))
+            report_accuracy(model, TFLiteModel(), validation)
+
+    def get_streamed(self, datapath, options):
+        files, labels = get_files(datapath)
+        if not files:
+            raise CommandError(f'No training images found in {datapath}.')
+        labels = get_label_encoder().transform(labels)
+
+        split = int(len(files) * (1 - options['validation_split']))
+        training = get_dataset(files[:split], labels[:split], options['batch_size'], True)
+        validation = get_dataset(files[split:], labels[split:], options['batch_size'], False)
+        return training, validation, split, len(files)
+
+    def get_cached(self, datapath, options):
+        images, labels = open_dataset(datapath)
+        if not len(labels):
+            raise CommandError(f'No prepared images found in {datapath}.')
+        write_label_file(labels.tolist())
+        labels = get_label_encoder().transform(labels)
+
+        indexes = np.random.default_rng(42).permutation(len(labels))
+        split = int(len(indexes) * (1 - options['validation_split']))
+        training = CachedImages(images, labels, indexes[:split], options['batch_size'], True)
+        validation = CachedImages(images, labels, indexes[split:], options['batch_size'], False)
+        return training, validation, split, len(labels)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0008_remove_data_css'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedCard',
+            fields=[
+                ('card', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rendered', serialize=False, to='flash_cards_api.card')),
+                ('question', models.TextField(blank=True, default='')),
+                ('answer', models.TextField(blank=True, default='')),
+                ('answer_text', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
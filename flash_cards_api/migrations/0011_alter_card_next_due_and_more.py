@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:44
+
+import datetime
+from django.db import migrations, models
+
+
+def set_missing_next_due(apps, schema_editor):
+    # Cards that were never studied are due now.
+    Card = apps.get_model('flash_cards_api', 'Card')
+    Card.objects.filter(next_due__isnull=True).update(next_due=datetime.date.today())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0010_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_missing_next_due, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='card',
+            name='next_due',
+            field=models.DateField(default=datetime.date.today),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['user', 'deck', 'next_due'], name='flash_cards_user_id_b25d8b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['deck', 'last_correct'], name='flash_cards_deck_id_4cf288_idx'),
+        ),
+    ]
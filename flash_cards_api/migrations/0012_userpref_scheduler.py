@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0011_alter_card_next_due_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userpref',
+            name='scheduler',
+            field=models.CharField(choices=[('QUADRATIC', 'Quadratic'), ('SM2', 'SM-2'), ('FSRS', 'FSRS')], default='QUADRATIC', max_length=20),
+        ),
+    ]
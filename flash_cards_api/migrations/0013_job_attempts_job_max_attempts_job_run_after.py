@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0012_userpref_scheduler'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='max_attempts',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='run_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
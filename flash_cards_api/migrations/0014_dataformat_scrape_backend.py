@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0013_job_attempts_job_max_attempts_job_run_after'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataformat',
+            name='scrape_backend',
+            field=models.CharField(choices=[('AUTO', 'Auto'), ('HTTP', 'HTTP'), ('BROWSER', 'Browser')], default='AUTO', max_length=20),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0014_dataformat_scrape_backend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScrapeResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('url', models.TextField()),
+                ('values', models.JSONField(default=dict)),
+                ('hits', models.IntegerField(default=0)),
+                ('misses', models.IntegerField(default=0)),
+                ('created', models.DateTimeField()),
+                ('last_used', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flash_cards_api', '0015_scraperesult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='renderedcard',
+            name='normalized_answer',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -1,18 +1,32 @@
-import math
-from datetime import datetime, timedelta
-from html.parser import HTMLParser
+from datetime import date, timedelta
 
-from django.db import models
-from django.db.models import Q
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Prefetch
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from django.template import Template, Context
+from django.template import Context
 from django.contrib.auth.models import User
 
+from flash_cards_api.helpers import jobs, scrape_cache
+from flash_cards_api.helpers.due import clear_due_counts
+from flash_cards_api.helpers.html import get_text, normalize_text
+from flash_cards_api.helpers.schedulers import get_scheduler, reschedule_cards
+from flash_cards_api.helpers.scraping import scrape
+from flash_cards_api.helpers.templates import get_template, clear_template_cache
+
+
+default_render_inline_limit = 1000
+
 
 class UserPref(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='pref')
     learning_rate = models.FloatField(default=0.03)
+    scheduler = models.CharField(max_length=20, default='QUADRATIC', choices=[
+        ('QUADRATIC', 'Quadratic'),
+        ('SM2', 'SM-2'),
+        ('FSRS', 'FSRS'),
+    ])
 
 
 class Deck(models.Model):
@@ -22,7 +36,7 @@ class Deck(models.Model):
 
     @property
     def due_cards(self):
-        return Card.objects.filter(Q(next_due__lte=datetime.now()) | Q(next_due__isnull=True), deck=self)
+        return Card.objects.filter(user_id=self.user_id, deck=self, next_due__lte=date.today()).order_by('next_due', 'id')
 
     def __str__(self):
         return self.name
@@ -32,6 +46,11 @@ class DataFormat(models.Model):
     # A data format is a collection of fields which define what is available to display on a card.
     name = models.CharField(max_length=100)
     url = models.CharField(max_length=512, null=True, blank=True)
+    scrape_backend = models.CharField(max_length=20, default='AUTO', choices=[
+        ('AUTO', 'Auto'),
+        ('HTTP', 'HTTP'),
+        ('BROWSER', 'Browser'),
+    ])
     user = models.ForeignKey(User, on_delete=models.CASCADE)
 
     def __str__(self):
@@ -69,7 +88,7 @@ class Card(models.Model):
     data = models.ForeignKey(Data, on_delete=models.CASCADE)
     last_seen = models.DateTimeField(null=True, blank=True)
     last_correct = models.DateTimeField(null=True, blank=True)
-    next_due = models.DateField(null=True, blank=True)
+    next_due = models.DateField(default=date.today)
     total_correct = models.IntegerField(default=0)
     total_wrong = models.IntegerField(default=0)
     current_streak = models.IntegerField(default=0)
@@ -77,36 +96,97 @@ class Card(models.Model):
 
     @property
     def field_data(self):
-        return {
-            value.field.name: value.value for value in self.data.field_value_set.all()
-        }
+        # Built once per instance and data, and cleared when the card is refreshed or rendered again.
+        cached = self.__dict__.get('_field_data')
+        if cached is None or cached[0] != self.data_id:
+            cached = (self.data_id, {
+                value.field.name: value.value for value in self.data.field_value_set.all()
+            })
+            self._field_data = cached
+        return cached[1]
+
+    def clear_field_data(self):
+        self.__dict__.pop('_field_data', None)
+
+    def refresh_from_db(self, *args, **kwargs):
+        self.clear_field_data()
+        super().refresh_from_db(*args, **kwargs)
 
     @property
     def question(self):
-        return Template(f'{{% autoescape off %}}{self.format.question_html}{{% endautoescape %}}').render(Context(self.field_data))
+        return self.get_rendered().question
 
     @property
     def answer(self):
-        return Template(f'{{% autoescape off %}}{self.format.answer_html}{{% endautoescape %}}').render(Context(self.field_data))
+        return self.get_rendered().answer
 
     @property
     def answer_text(self):
-        class HTMLFilter(HTMLParser):
-            text = ''
-            def handle_data(self, data):
-                self.text += data
-        f = HTMLFilter()
-        f.feed(self.answer)
-        return f.text
-
-    def calculate_next_due(self):
-        learning_rate = self.user.pref.learning_rate
-        days = math.floor(learning_rate * self.current_streak ** 2 + 0.9)
+        return self.get_rendered().answer_text
+
+    @property
+    def normalized_answer(self):
+        rendered = self.get_rendered()
+        return rendered.normalized_answer or normalize_text(rendered.answer_text)
+
+    def render(self):
+        field_data = self.field_data
+        answer = get_template(self.format, 'answer').render(Context(field_data))
+        answer_text = get_text(answer)
+        return RenderedCard(
+            card=self,
+            question=get_template(self.format, 'question').render(Context(field_data)),
+            answer=answer,
+            answer_text=answer_text,
+            normalized_answer=normalize_text(answer_text) if getattr(settings, 'NORMALIZE_ANSWERS', False) else '',
+        )
+
+    def get_rendered(self):
+        try:
+            return self.rendered
+        except RenderedCard.DoesNotExist:
+            return render_cards([self])[0]
+
+    def record_result(self, correct, study, timestamp, pref=None):
+        self.last_seen = timestamp
+        if correct:
+            self.last_correct = timestamp
+        if study:
+            if correct:
+                self.total_correct += 1
+                self.current_streak += 1
+            else:
+                self.total_wrong += 1
+                self.current_streak = 0
+            self.calculate_next_due(pref)
+
+    def calculate_next_due(self, pref=None):
+        pref = pref or self.user.pref
+        days = get_scheduler(pref.scheduler).days(self.current_streak, pref.learning_rate)
         self.next_due = (self.last_seen + timedelta(days=days)).date()
 
     def __str__(self):
         return f'{self.format}: {self.data}'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deck', 'next_due']),
+            models.Index(fields=['deck', 'last_correct']),
+        ]
+
+
+class RenderedCard(models.Model):
+    # A rendered card is the stored output of a card's templates, kept up to date when its inputs change.
+    card = models.OneToOneField(Card, on_delete=models.CASCADE, primary_key=True, related_name='rendered')
+    question = models.TextField(blank=True, default='')
+    answer = models.TextField(blank=True, default='')
+    answer_text = models.TextField(blank=True, default='')
+    # Only filled when NORMALIZE_ANSWERS is set.
+    normalized_answer = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return str(self.card)
+
 
 class Field(models.Model):
     # A field is a container which defines a piece of information in a format.
@@ -127,31 +207,273 @@ class FieldValue(models.Model):
     def __str__(self):
         return f'{self.field.name}: {self.value}'
 
+    def delete(self, *args, **kwargs):
+        # Re-rendering here rather than in a post_delete receiver keeps cascading deletes of values fast.
+        result = super().delete(*args, **kwargs)
+        render_card_set(Card.objects.filter(data_id=self.parent_id))
+        return result
+
     class Meta:
         unique_together = ('field', 'parent')
 
 
-@receiver(post_save, sender=Data)
-def data_post_save(sender, instance, created, *args, **kwargs):
-    if created:
-        card_formats = instance.format.cardformat_set.all()
-        for card_format in card_formats:
-            Card.objects.create(
+class Job(models.Model):
+    # A job is a piece of work run by the background workers, such as creating the cards of a new card format.
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, default=PENDING)
+    payload = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=1)
+    run_after = models.DateTimeField(null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.kind} {self.id}: {self.status}'
+
+
+class ScrapeResult(models.Model):
+    # A scrape result caches the values read from a page for one set of xpaths, shared by all users.
+    key = models.CharField(max_length=40, unique=True)
+    url = models.TextField()
+    values = models.JSONField(default=dict)
+    hits = models.IntegerField(default=0)
+    misses = models.IntegerField(default=0)
+    created = models.DateTimeField()
+    last_used = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.url
+
+
+def render_cards(cards):
+    for card in cards:
+        card.clear_field_data()
+    rendered = [card.render() for card in cards]
+    RenderedCard.objects.bulk_create(
+        rendered,
+        update_conflicts=True,
+        unique_fields=['card'],
+        update_fields=['question', 'answer', 'answer_text', 'normalized_answer'],
+    )
+    for card, rendered_card in zip(cards, rendered):
+        card.rendered = rendered_card
+    return rendered
+
+
+def render_card_set(queryset, chunk_size=1000):
+    cards = queryset.select_related('format').prefetch_related(
+        Prefetch('data__field_value_set', queryset=FieldValue.objects.select_related('field'))
+    )
+    chunk = []
+    for card in cards.iterator(chunk_size=chunk_size):
+        chunk.append(card)
+        if len(chunk) >= chunk_size:
+            render_cards(chunk)
+            chunk = []
+    if chunk:
+        render_cards(chunk)
+
+
+def fan_out_cards(card_formats, data_set, chunk_size=1000):
+    # Creates a card for every pairing of card format and data, inserting them in chunks.
+    card_formats = list(card_formats)
+    if not card_formats:
+        return 0
+    if isinstance(data_set, models.QuerySet):
+        data_set = data_set.only('id', 'user_id').iterator(chunk_size=chunk_size)
+    total = 0
+    chunk = []
+    for data in data_set:
+        chunk.append(data.id)
+        if len(chunk) * len(card_formats) >= chunk_size:
+            total += create_cards(card_formats, chunk, data.user_id)
+            chunk = []
+    if chunk:
+        total += create_cards(card_formats, chunk, data.user_id)
+    return total
+
+
+def create_cards(card_formats, data_ids, user_id):
+    with transaction.atomic():
+        Card.objects.bulk_create([
+            Card(
                 format=card_format,
-                data=instance,
-                deck=card_format.default_deck,
-                user=instance.user,
+                data_id=data_id,
+                deck_id=card_format.default_deck_id,
+                user_id=user_id,
             )
+            for data_id in data_ids for card_format in card_formats
+        ])
+        clear_due_counts(*{card_format.default_deck_id for card_format in card_formats})
+        render_card_set(Card.objects.filter(format__in=card_formats, data_id__in=data_ids))
+    return len(data_ids) * len(card_formats)
+
+
+@jobs.register('fan_out_cards')
+def fan_out_card_format(card_format_id):
+    # Data created after the card format already got its card from data_post_save.
+    card_format = CardFormat.objects.get(id=card_format_id)
+    data_set = card_format.data_format.data_set.exclude(card__format=card_format)
+    return {'created': fan_out_cards([card_format], data_set)}
+
+
+@receiver(post_save, sender=Data)
+def data_post_save(sender, instance, created, *args, **kwargs):
+    if not created:
+        render_card_set(instance.card_set.all())
+    else:
+        fan_out_cards(instance.format.cardformat_set.all(), [instance])
+
+
+@jobs.register('render_card_format')
+def render_card_format(card_format_id):
+    render_card_set(Card.objects.filter(format_id=card_format_id))
+    return {'rendered': Card.objects.filter(format_id=card_format_id).count()}
+
+
+@receiver(pre_save, sender=CardFormat)
+def card_format_pre_save(sender, instance, *args, **kwargs):
+    previous = CardFormat.objects.filter(pk=instance.pk).values('question_html', 'answer_html').first()
+    instance.templates_changed = previous is not None and previous != {
+        'question_html': instance.question_html,
+        'answer_html': instance.answer_html,
+    }
 
 
 @receiver(post_save, sender=CardFormat)
 def card_format_post_save(sender, instance, created, *args, **kwargs):
+    if not created:
+        # Only template edits change rendered cards, and large formats are re-rendered by a background job.
+        if getattr(instance, 'templates_changed', False):
+            clear_template_cache(instance.id)
+            if instance.card_set.count() > getattr(settings, 'RENDER_INLINE_LIMIT', default_render_inline_limit):
+                instance.render_job = jobs.enqueue('render_card_format', instance.user, card_format_id=instance.id)
+            else:
+                render_card_set(instance.card_set.all())
+    elif getattr(settings, 'DEFER_CARD_FAN_OUT', False):
+        instance.fan_out_job = jobs.enqueue('fan_out_cards', instance.user, card_format_id=instance.id)
+    else:
+        fan_out_cards([instance], instance.data_format.data_set.all())
+
+
+@receiver(post_delete, sender=CardFormat)
+def card_format_post_delete(sender, instance, *args, **kwargs):
+    clear_template_cache(instance.id)
+
+
+def get_scrape_target(data):
+    # Returns the resolved URL of the data and the fields read from it.
+    field_dict = {
+        value.field.name: value.value for value in data.field_value_set.select_related('field')
+    }
+    fields = list(data.format.field_set.filter(xpath__isnull=False).exclude(xpath=''))
+    return data.format.url.format(**field_dict), fields
+
+
+def save_scraped_values(data, values):
+    for field, value in values.items():
+        FieldValue.objects.update_or_create(field=field, parent=data, defaults={'value': value})
+
+
+def fill_from_scrape_cache(data):
+    # Saves the scraped values of the data from the cache, returning False when they have to be scraped.
+    url, fields = get_scrape_target(data)
+    values = scrape_cache.get_values(url, fields)
+    if values is None:
+        return False
+    save_scraped_values(data, values)
+    return True
+
+
+@jobs.register('scrape_data')
+def scrape_data(data_id):
+    data = Data.objects.select_related('format').get(id=data_id)
+    url, fields = get_scrape_target(data)
+    values = scrape_cache.get_values(url, fields)
+    if values is None:
+        values = scrape(url, fields, data.format.scrape_backend)
+        scrape_cache.store_values(url, values)
+    save_scraped_values(data, values)
+    return {'fields': len(values)}
+
+
+@jobs.register('scrape_data_set')
+def scrape_data_set(data_ids):
+    # Scrapes imported data one page at a time. Scraped pages are cached, so a retry only loads the pages that failed.
+    errors = []
+    for data_id in data_ids:
+        try:
+            scrape_data(data_id)
+        except Data.DoesNotExist:
+            pass
+        except Exception as e:
+            errors.append(f'Data {data_id}: {e}')
+    if errors:
+        raise RuntimeError(f'{len(errors)} of {len(data_ids)} pages failed. {errors[0]}')
+    return {'scraped': len(data_ids)}
+
+
+@jobs.register('reschedule_cards')
+def reschedule_user_cards(user_id):
+    return {'rescheduled': reschedule_cards(User.objects.select_related('pref').get(id=user_id))}
+
+
+@receiver(pre_save, sender=UserPref)
+def user_pref_pre_save(sender, instance, *args, **kwargs):
+    previous = UserPref.objects.filter(pk=instance.pk).values('learning_rate', 'scheduler').first()
+    instance.schedule_changed = previous is not None and previous != {
+        'learning_rate': instance.learning_rate,
+        'scheduler': instance.scheduler,
+    }
+
+
+@receiver(post_save, sender=UserPref)
+def user_pref_post_save(sender, instance, *args, **kwargs):
+    if getattr(instance, 'schedule_changed', False):
+        instance.reschedule_job = jobs.enqueue('reschedule_cards', instance.user, user_id=instance.user_id)
+
+
+@receiver(post_save, sender=Card)
+def card_post_save(sender, instance, created, *args, **kwargs):
     if created:
-        data_set = instance.data_format.data_set.all()
-        for data in data_set:
-            Card.objects.create(
-                format=instance,
-                data=data,
-                deck=instance.default_deck,
-                user=instance.user,
-            )
+        render_cards([instance])
+        clear_due_counts(instance.deck_id)
+
+
+@receiver(post_delete, sender=Card)
+def card_post_delete(sender, instance, *args, **kwargs):
+    clear_due_counts(instance.deck_id)
+
+
+@receiver(pre_save, sender=Field)
+def field_pre_save(sender, instance, *args, **kwargs):
+    previous_name = Field.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+    instance.renamed = previous_name is not None and previous_name != instance.name
+
+
+@receiver(post_save, sender=Field)
+def field_post_save(sender, instance, created, *args, **kwargs):
+    if getattr(instance, 'renamed', False):
+        render_card_set(Card.objects.filter(data__format_id=instance.data_format_id))
+
+
+@receiver(post_save, sender=FieldValue)
+def field_value_post_save(sender, instance, *args, **kwargs):
+    render_card_set(Card.objects.filter(data_id=instance.parent_id))
+
+
+@receiver(post_delete, sender=Field)
+def field_post_delete(sender, instance, origin=None, *args, **kwargs):
+    # Cards are re-rendered once for the deleted field, and not at all when its data format is being deleted.
+    origin_model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    if origin_model is Field:
+        render_card_set(Card.objects.filter(data__format_id=instance.data_format_id))
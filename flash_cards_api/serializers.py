@@ -1,9 +1,24 @@
+from django.conf import settings
+
 from flash_cards_api import models
-from flash_cards_api.helpers.selenium import get_value
+from flash_cards_api.helpers.due import get_due_counts, clear_due_counts
+from flash_cards_api.helpers import jobs
+from flash_cards_api.helpers.pagination import get_requested_fields
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
 
-from selenium import webdriver
-from selenium.webdriver.firefox.options import Options
+class SparseFieldsMixin:
+    # Drops the fields not named in ?fields= from read responses, so they are never computed.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        requested = get_requested_fields(request)
+        if requested is not None:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
 
 
 class FieldSerializer(serializers.ModelSerializer):
@@ -26,7 +41,7 @@ class FieldValueSerializer(serializers.ModelSerializer):
         validators = []
 
 
-class CardSerializer(serializers.ModelSerializer):
+class CardSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     name = serializers.SerializerMethodField()
     question = serializers.CharField()
     answer = serializers.CharField()
@@ -44,8 +59,39 @@ class CardSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Card Format and Data Format do not match.')
         return data
 
+    def update(self, instance, validated_data):
+        previous_deck_id = instance.deck_id
+        instance = super().update(instance, validated_data)
+        models.render_cards([instance])
+        clear_due_counts(previous_deck_id, instance.deck_id)
+        return instance
+
+
+class ReviewSerializer(serializers.Serializer):
+    card_id = serializers.IntegerField()
+    result = serializers.ChoiceField(choices=['correct', 'incorrect'])
+    study = serializers.BooleanField(default=False)
+    timestamp = serializers.DateTimeField(required=False)
+
+
+class ReviewResultSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Card
+        fields = ['id', 'next_due', 'current_streak', 'total_correct', 'total_wrong']
+
+
+class CardFormatSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    fan_out_job = serializers.SerializerMethodField()
+    render_job = serializers.SerializerMethodField()
+
+    def get_fan_out_job(self, instance):
+        job = getattr(instance, 'fan_out_job', None)
+        return job.id if job else None
+
+    def get_render_job(self, instance):
+        job = getattr(instance, 'render_job', None)
+        return job.id if job else None
 
-class CardFormatSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.CardFormat
         fields = '__all__'
@@ -55,8 +101,35 @@ class CardQuizSerializer(CardSerializer):
     format = CardFormatSerializer()
 
 
-class DataSerializer(serializers.ModelSerializer):
+class JobSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = models.Job
+        exclude = ['payload']
+
+
+class DataImportSerializer(serializers.Serializer):
+    data_format = serializers.PrimaryKeyRelatedField(queryset=models.DataFormat.objects.all())
+    rows = serializers.ListField(child=serializers.JSONField(), required=False)
+    file = serializers.FileField(required=False)
+
+    def validate_data_format(self, value):
+        if value.user_id != self.context['request'].user.id:
+            raise serializers.ValidationError('Data format does not exist.')
+        return value
+
+    def validate(self, data):
+        if 'rows' not in data and 'file' not in data:
+            raise serializers.ValidationError('Either rows or a file is required.')
+        return super().validate(data)
+
+
+class DataSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     field_value_set = FieldValueSerializer(many=True, partial=True)
+    scrape_job = serializers.SerializerMethodField()
+
+    def get_scrape_job(self, instance):
+        job = getattr(instance, 'scrape_job', None)
+        return JobSerializer(job).data if job else None
 
     class Meta:
         model = models.Data
@@ -91,24 +164,13 @@ class DataSerializer(serializers.ModelSerializer):
             )
             serializer.is_valid(raise_exception=True)
             serializer.save()
-        if instance.format.url:
-            options = Options()
-            options.add_argument('--headless')
-            driver = webdriver.Firefox(options=options)
-            driver.get(instance.format.url.format(**field_dict))
-            for field in instance.format.field_set.filter(xpath__isnull=False).exclude(xpath=''):
-                value = get_value(driver, field.xpath)
-                serializer = FieldValueSerializer(
-                    data={
-                        'parent': instance.id,
-                        'field': field.id,
-                        'value': value
-                    },
-                    partial=True
-                )
-                serializer.is_valid(raise_exception=True)
-                serializer.save()
-            driver.close()
+        if instance.format.url and not models.fill_from_scrape_cache(instance):
+            instance.scrape_job = jobs.enqueue(
+                'scrape_data',
+                instance.user,
+                max_attempts=getattr(settings, 'SCRAPE_MAX_ATTEMPTS', 3),
+                data_id=instance.id,
+            )
         return instance
 
     def update(self, instance, validated_data):
@@ -148,7 +210,7 @@ class DataSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class DataFormatSerializer(serializers.ModelSerializer):
+class DataFormatSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     field_set = FieldSerializer(many=True, partial=True)
 
     class Meta:
@@ -199,11 +261,14 @@ class DataFormatSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class DeckSerializer(serializers.ModelSerializer):
+class DeckSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     num_due = serializers.SerializerMethodField(required=False)
 
     def get_num_due(self, instance):
-        return instance.due_cards.count()
+        due_counts = self.context.get('due_counts')
+        if due_counts is None:
+            due_counts = get_due_counts([instance])
+        return due_counts.get(instance.id, 0)
 
     class Meta:
         model = models.Deck
@@ -216,3 +281,23 @@ class DeckDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Deck
         fields = '__all__'
+
+
+class CardSummarySerializer(serializers.ModelSerializer):
+    name = serializers.SerializerMethodField()
+
+    def get_name(self, instance):
+        return str(instance)
+
+    class Meta:
+        model = models.Card
+        fields = ['id', 'name', 'format', 'data', 'last_seen', 'last_correct', 'next_due', 'total_correct',
+                  'total_wrong', 'current_streak']
+
+
+class DeckSummarySerializer(serializers.ModelSerializer):
+    card_set = CardSummarySerializer(many=True)
+
+    class Meta:
+        model = models.Deck
+        fields = '__all__'
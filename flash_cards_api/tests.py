@@ -1,3 +1,913 @@
-from django.test import TestCase
+import json
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from flash_cards_api import models
+from flash_cards_api.helpers import html, http, importing, jobs, scrape_cache, templates
+from flash_cards_api.helpers.browser import BrowserPool
+from flash_cards_api.helpers.due import get_cache_key, get_due_counts
+from flash_cards_api.helpers.jobs import handlers
+from flash_cards_api.helpers.schedulers import reschedule_cards, schedulers
+
+
+def create_collection(username='user', num_data=1, scheduler='QUADRATIC'):
+    # Creates a user with a deck holding one card per data.
+    user = User.objects.create_user(username, password='password')
+    models.UserPref.objects.create(user=user, scheduler=scheduler)
+    deck = models.Deck.objects.create(name='Deck', user=user)
+    data_format = models.DataFormat.objects.create(name='Words', user=user)
+    word = models.Field.objects.create(name='word', data_format=data_format, xpath='')
+    meaning = models.Field.objects.create(name='meaning', data_format=data_format, xpath='')
+    models.CardFormat.objects.create(
+        name='Meaning', question_html='<b>{{ word }}</b>', answer_html='{{ meaning }}',
+        data_format=data_format, default_deck=deck, user=user,
+    )
+    for i in range(num_data):
+        data = models.Data.objects.create(name=f'Word {i}', format=data_format, user=user)
+        models.FieldValue.objects.create(field=word, parent=data, value=f'word {i}')
+        models.FieldValue.objects.create(field=meaning, parent=data, value=f'meaning {i}')
+    client = APIClient()
+    client.force_authenticate(user)
+    return user, deck, client
+
+
+class SchedulerTests(TestCase):
+    streaks = list(range(0, 60)) + [100, 1000, 100000]
+
+    def test_days_array_matches_days(self):
+        for name, scheduler in schedulers.items():
+            for learning_rate in (0.03, 0.5):
+                expected = [scheduler.days(streak, learning_rate) for streak in self.streaks]
+                days = scheduler.days_array(np.array(self.streaks), learning_rate)
+                self.assertEqual(expected, days.astype(int).tolist(), name)
+
+    @override_settings(SCHEDULER_MAX_INTERVAL=365)
+    def test_intervals_are_capped(self):
+        for name, scheduler in schedulers.items():
+            self.assertEqual(scheduler.days(100000, 0.03), 365, name)
+            self.assertEqual(scheduler.days_array(np.array([100000]), 0.03).tolist(), [365], name)
+
+    def test_long_streak_does_not_overflow(self):
+        for name in schedulers:
+            user, deck, client = create_collection(name, scheduler=name)
+            card = models.Card.objects.get(user=user)
+            models.Card.objects.filter(id=card.id).update(current_streak=100000, last_seen=timezone.now())
+            response = client.post(f'/api/cards/{card.id}/correct/', {'study': True}, format='json')
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(reschedule_cards(user), 1, name)
+            card.refresh_from_db()
+            self.assertLessEqual(card.next_due, (card.last_seen + timedelta(days=36500)).date(), name)
+
+
+class DueCardTests(TestCase):
+    def test_quiz_serves_the_earliest_due_card_in_one_query(self):
+        user, deck, client = create_collection(num_data=4)
+        today = timezone.localdate()
+        first, second, third, future = models.Card.objects.filter(user=user).order_by('id')
+        for card, next_due in [(first, today), (second, today - timedelta(days=1)), (third, today - timedelta(days=1)),
+                               (future, today + timedelta(days=1))]:
+            models.Card.objects.filter(id=card.id).update(next_due=next_due)
+        self.assertEqual(list(deck.due_cards.values_list('id', flat=True)), [second.id, third.id, first.id])
+        # One query for the deck and one for its first due card, joined with everything the card shows.
+        with self.assertNumQueries(2):
+            response = client.get(f'/api/decks/{deck.id}/quiz/')
+        self.assertEqual(response.json()['id'], second.id)
+        models.Card.objects.filter(user=user).update(next_due=today + timedelta(days=1))
+        self.assertEqual(client.get(f'/api/decks/{deck.id}/quiz/').status_code, 204)
+
+
+class DueCardMigrationTests(TransactionTestCase):
+    migrate_from = ('flash_cards_api', '0010_job')
+    migrate_to = ('flash_cards_api', '0011_alter_card_next_due_and_more')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def test_missing_next_due_is_backfilled(self):
+        apps = self.migrate(self.migrate_from)
+        try:
+            user = apps.get_model('auth', 'User').objects.create(username='user')
+            data_format = apps.get_model('flash_cards_api', 'DataFormat').objects.create(name='Words', user=user)
+            data = apps.get_model('flash_cards_api', 'Data').objects.create(name='Word', format=data_format, user=user)
+            card_format = apps.get_model('flash_cards_api', 'CardFormat').objects.create(
+                name='Meaning', question_html='', answer_html='', data_format=data_format, user=user,
+            )
+            Card = apps.get_model('flash_cards_api', 'Card')
+            due = date.today() + timedelta(days=3)
+            missing = Card.objects.create(format=card_format, data=data, user=user, next_due=None)
+            scheduled = Card.objects.create(format=card_format, data=data, user=user, next_due=due)
+
+            apps = self.migrate(self.migrate_to)
+            Card = apps.get_model('flash_cards_api', 'Card')
+            self.assertEqual(Card.objects.get(id=missing.id).next_due, date.today())
+            self.assertEqual(Card.objects.get(id=scheduled.id).next_due, due)
+        finally:
+            self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes('flash_cards_api')[0])
+
+
+class DeckListTests(TestCase):
+    def count_list_queries(self, num_data):
+        user, deck, client = create_collection(f'user{num_data}', num_data)
+        models.Deck.objects.create(name='Empty', user=user)
+        with self.assertNumQueries(2):
+            response = client.get('/api/decks/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({deck['name']: deck['num_due'] for deck in response.json()}, {'Deck': num_data, 'Empty': 0})
+
+    def test_query_count_does_not_depend_on_cards(self):
+        self.count_list_queries(1)
+        self.count_list_queries(25)
+
+    @override_settings(DUE_COUNT_CACHE_TIMEOUT=60)
+    def test_counts_read_during_an_import_are_cleared(self):
+        user, deck, client = create_collection(num_data=1)
+        data_format = models.DataFormat.objects.get(user=user)
+        self.assertEqual(get_due_counts([deck]), {deck.id: 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            importing.import_data(data_format, user, [{'name': 'Word 1', 'word': 'word 1', 'meaning': 'meaning 1'}])
+            # A request made before the import commits still counts the old cards.
+            cache.set(get_cache_key(deck.id), 1)
+        self.assertEqual(get_due_counts([deck]), {deck.id: 2})
+
+
+class DeckDetailTests(TestCase):
+    def assert_detail_queries(self, num_data):
+        user, deck, client = create_collection(f'user{num_data}', num_data)
+        with self.assertNumQueries(3):
+            response = client.get(f'/api/decks/{deck.id}/')
+        self.assertEqual(len(response.json()['card_set']), num_data)
+        self.assertEqual(response.json()['card_set'][0]['question'], '<b>word 0</b>')
+        with self.assertNumQueries(2):
+            response = client.get(f'/api/decks/{deck.id}/?summary=1')
+        self.assertEqual(len(response.json()['card_set']), num_data)
+        self.assertNotIn('question', response.json()['card_set'][0])
+
+    def test_query_count_does_not_depend_on_cards(self):
+        self.assert_detail_queries(1)
+        self.assert_detail_queries(25)
+
+
+class QueueTests(TestCase):
+    def test_queue_is_revalidated_by_version(self):
+        user, deck, client = create_collection(num_data=3)
+        response = client.get(f'/api/decks/{deck.id}/queue/?size=20')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['cards']), 3)
+        etag = response['ETag']
+        self.assertEqual(etag, f'"{response.json()["version"]}"')
+        response = client.get(f'/api/decks/{deck.id}/queue/?size=20', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # An answer from another tab changes the queue, so the stored version no longer matches.
+        card_id = models.Card.objects.filter(user=user).first().id
+        client.post(f'/api/cards/{card_id}/correct/', {'study': True}, format='json')
+        response = client.get(f'/api/decks/{deck.id}/queue/?size=20', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class PaginationTests(TestCase):
+    def test_lists_are_plain_without_paging_parameters(self):
+        user, deck, client = create_collection(num_data=3)
+        for path in ['/api/cards/', '/api/decks/', '/api/data/']:
+            response = client.get(path)
+            self.assertIsInstance(response.json(), list, path)
+        self.assertEqual(len(client.get('/api/cards/').json()), 3)
+
+    def read_pages(self, client, path):
+        pages = []
+        while path:
+            response = client.get(path).json()
+            pages.append(response['results'])
+            path = response['next']
+        return pages
+
+    def test_cursor_pages(self):
+        user, deck, client = create_collection(num_data=3)
+        other_deck = models.Deck.objects.create(name='Other', user=user)
+        card_ids = list(models.Card.objects.filter(user=user).order_by('id').values_list('id', flat=True))
+        pages = self.read_pages(client, '/api/cards/?page_size=2')
+        self.assertEqual([[card['id'] for card in page] for page in pages], [card_ids[:2], card_ids[2:]])
+        pages = self.read_pages(client, '/api/decks/?page_size=1')
+        self.assertEqual(
+            [[(deck['id'], deck['num_due']) for deck in page] for page in pages],
+            [[(deck.id, 3)], [(other_deck.id, 0)]],
+        )
+        response = client.get('/api/decks/?cursor=')
+        self.assertEqual([deck['id'] for deck in response.json()['results']], [deck.id, other_deck.id])
+
+    def test_fields_are_only_dropped_from_reads(self):
+        user, deck, client = create_collection(num_data=1)
+        card = models.Card.objects.get(user=user)
+        response = client.get('/api/cards/?fields=id,next_due')
+        self.assertEqual(response.json(), [{'id': card.id, 'next_due': card.next_due.isoformat()}])
+        with self.assertNumQueries(1):
+            response = client.get('/api/decks/?fields=id,name')
+        self.assertEqual(response.json(), [{'id': deck.id, 'name': 'Deck'}])
+        response = client.post('/api/decks/?fields=id', {'name': 'New'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['name'], 'New')
+        response = client.patch(f'/api/cards/{card.id}/?fields=id', {'total_correct': 4}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_correct'], 4)
+
+    def test_sparse_pages_skip_related_rows(self):
+        user, deck, client = create_collection(num_data=25)
+        # Only the cards are read, without the data, format, rendered sides or field values.
+        with self.assertNumQueries(1):
+            response = client.get('/api/cards/?page_size=10&fields=id,deck,next_due')
+        self.assertEqual(len(response.json()['results']), 10)
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'deck', 'next_due'})
+        with self.assertNumQueries(1):
+            response = client.get('/api/cards/?fields=id,deck,next_due')
+        self.assertEqual(len(response.json()), 25)
+
+
+class StartupTests(TestCase):
+    heavy_modules = ['selenium', 'cv2', 'numpy', 'sklearn', 'tensorflow']
+    max_startup_seconds = 5
+
+    def test_wsgi_startup_skips_heavy_modules(self):
+        # The app is loaded in a fresh interpreter, as a worker would, along with the URLs and views.
+        script = (
+            'import json, sys, time\n'
+            'start = time.perf_counter()\n'
+            'import study_site.wsgi, study_site.urls\n'
+            'print(json.dumps({"seconds": time.perf_counter() - start, "modules": list(sys.modules)}))\n'
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent.parent,
+        )
+        startup = json.loads(result.stdout.strip().splitlines()[-1])
+        loaded = {name.split('.')[0] for name in startup['modules']}
+        self.assertEqual([name for name in self.heavy_modules if name in loaded], [])
+        self.assertLess(startup['seconds'], self.max_startup_seconds)
+
+
+class TemplateCacheTests(TestCase):
+    def setUp(self):
+        templates.clear_template_cache()
+
+    def test_cache_hits_reuse_the_compiled_template(self):
+        user, deck, client = create_collection(num_data=0)
+        card_format = models.CardFormat.objects.get(user=user)
+        with mock.patch.object(templates, 'Template', wraps=templates.Template) as compile_template:
+            template = templates.get_template(card_format, 'question')
+            self.assertIs(templates.get_template(card_format, 'question'), template)
+            self.assertIsNot(templates.get_template(card_format, 'answer'), template)
+        self.assertEqual(compile_template.call_count, 2)
+
+    @override_settings(CARD_TEMPLATE_CACHE_SIZE=2)
+    def test_least_recently_used_templates_are_evicted(self):
+        user, deck, client = create_collection(num_data=0)
+        card_format = models.CardFormat.objects.get(user=user)
+        question = templates.get_template(card_format, 'question')
+        answer = templates.get_template(card_format, 'answer')
+        templates.get_template(card_format, 'question')
+        card_format.question_html = '<i>{{ word }}</i>'
+        templates.get_template(card_format, 'question')
+        card_format.question_html = '<b>{{ word }}</b>'
+        self.assertIs(templates.get_template(card_format, 'question'), question)
+        self.assertIsNot(templates.get_template(card_format, 'answer'), answer)
+
+    def test_template_edits_are_served(self):
+        user, deck, client = create_collection(num_data=1)
+        card = models.Card.objects.get(user=user)
+        self.assertEqual(client.get(f'/api/cards/{card.id}/').json()['question'], '<b>word 0</b>')
+        card_format = models.CardFormat.objects.get(user=user)
+        card_format.question_html = '<i>{{ word }}</i>'
+        card_format.save()
+        self.assertEqual(client.get(f'/api/cards/{card.id}/').json()['question'], '<i>word 0</i>')
+        card.format.question_html = '<u>{{ word }}</u>'
+        self.assertEqual(card.render().question, '<u>word 0</u>')
+
+
+class RenderTests(TestCase):
+    def count_field_delete_queries(self, num_data):
+        user, deck, client = create_collection(f'user{num_data}', num_data)
+        field = models.Field.objects.get(data_format__user=user, name='meaning')
+        with CaptureQueriesContext(connection) as queries:
+            field.delete()
+        self.assertEqual(models.RenderedCard.objects.filter(card__user=user, answer='').count(), num_data)
+        return len(queries)
+
+    def test_field_delete_renders_once(self):
+        self.assertEqual(self.count_field_delete_queries(1), self.count_field_delete_queries(30))
+
+    def test_card_format_renders_only_on_template_change(self):
+        user, deck, client = create_collection(num_data=3)
+        card_format = models.CardFormat.objects.get(user=user)
+        other_deck = models.Deck.objects.create(name='Other', user=user)
+        card_format.name = 'Renamed'
+        card_format.default_deck = other_deck
+        with CaptureQueriesContext(connection) as queries:
+            card_format.save()
+        self.assertFalse([query for query in queries if 'rendered' in query['sql'].lower()])
+
+        card_format.answer_html = '<i>{{ meaning }}</i>'
+        card_format.save()
+        self.assertEqual(models.Card.objects.filter(user=user)[0].answer, '<i>meaning 0</i>')
+
+    @override_settings(RENDER_INLINE_LIMIT=2)
+    def test_large_card_format_is_rendered_by_a_job(self):
+        user, deck, client = create_collection(num_data=3)
+        card_format = models.CardFormat.objects.get(user=user)
+        card_format.answer_html = '<i>{{ meaning }}</i>'
+        with self.captureOnCommitCallbacks() as callbacks:
+            card_format.save()
+        self.assertEqual(card_format.render_job.kind, 'render_card_format')
+        self.assertEqual(len(callbacks), 1)
+        handlers[card_format.render_job.kind](**card_format.render_job.payload)
+        self.assertEqual(
+            set(models.RenderedCard.objects.filter(card__user=user).values_list('answer', flat=True)),
+            {f'<i>meaning {i}</i>' for i in range(3)},
+        )
+
+
+class FanOutTests(TestCase):
+    @override_settings(DEFER_CARD_FAN_OUT=True)
+    def test_deferred_fan_out_skips_data_created_meanwhile(self):
+        user, deck, client = create_collection(num_data=2)
+        data_format = models.DataFormat.objects.get(user=user)
+        card_format = models.CardFormat.objects.create(
+            name='Word', question_html='{{ meaning }}', answer_html='{{ word }}',
+            data_format=data_format, default_deck=deck, user=user,
+        )
+        late = models.Data.objects.create(name='Late', format=data_format, user=user)
+        job = card_format.fan_out_job
+        self.assertEqual(handlers[job.kind](**job.payload), {'created': 2})
+        for data in models.Data.objects.filter(user=user):
+            self.assertEqual(data.card_set.filter(format=card_format).count(), 1, data.name)
+        self.assertEqual(late.card_set.count(), 2)
+
+
+class DataImportTests(TestCase):
+    def post_file(self, client, data_format, content):
+        return client.post('/api/data/import/', {
+            'data_format': data_format.id,
+            'file': SimpleUploadedFile('words.csv', content, content_type='text/csv'),
+        }, format='multipart')
+
+    def test_csv_import(self):
+        user, deck, client = create_collection(num_data=0)
+        data_format = models.DataFormat.objects.get(user=user)
+        response = self.post_file(client, data_format, b'name,word,meaning\r\nOne,one,1\r\n,two,2\r\n')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(response.json()['errors'], [{'row': 2, 'errors': ['Name is required.']}])
+        self.assertEqual(models.Card.objects.get(user=user).question, '<b>one</b>')
+
+    def test_unreadable_files_are_rejected(self):
+        user, deck, client = create_collection(num_data=0)
+        data_format = models.DataFormat.objects.get(user=user)
+        for content in [b'\xff\xfename,word\r\n', b'name,word\r\nOne,\xff\xfe\r\n']:
+            response = self.post_file(client, data_format, content)
+            self.assertEqual(response.status_code, 400, content)
+        self.assertFalse(models.Data.objects.filter(user=user).exists())
+
+    def import_scraped(self, username, num_rows):
+        user, deck, client = create_collection(username, num_data=0)
+        data_format = models.DataFormat.objects.get(user=user)
+        data_format.url = 'https://example.com/{word}'
+        data_format.save()
+        audio = models.Field.objects.create(name='audio', data_format=data_format, xpath='//audio/@src')
+        models.CardFormat.objects.create(
+            name='Audio', question_html='{{ word }}', answer_html='{{ audio }}',
+            data_format=data_format, default_deck=deck, user=user,
+        )
+        for i in range(num_rows):
+            scrape_cache.store_values(f'https://example.com/word{i}', {audio: f'word{i}.mp3'})
+        rows = [{'name': f'Word {i}', 'word': f'word{i}'} for i in range(num_rows + 1)]
+        with CaptureQueriesContext(connection) as queries:
+            report = importing.import_data(data_format, user, rows)
+        return user, report, len(queries)
+
+    def test_scraped_fields_are_filled_from_the_cache(self):
+        user, report, num_queries = self.import_scraped('user', 2)
+        self.assertEqual((report['created'], report['scrape_cached'], report['scrape_jobs']), (3, 2, 1))
+        self.assertEqual(
+            sorted(models.Card.objects.filter(user=user, format__name='Audio').values_list('rendered__answer', flat=True)),
+            ['', 'word0.mp3', 'word1.mp3'],
+        )
+        job = models.Job.objects.get(user=user)
+        self.assertEqual(job.kind, 'scrape_data_set')
+        self.assertEqual(job.payload['data_ids'], [models.Data.objects.get(user=user, name='Word 2').id])
+        self.assertEqual(scrape_cache.get_stats()['hits'], 2)
+        audio = models.Field.objects.get(data_format__user=user, name='audio')
+        with mock.patch.object(models, 'scrape', return_value={audio: 'word2.mp3'}):
+            self.assertEqual(handlers[job.kind](**job.payload), {'scraped': 1})
+        self.assertEqual(models.Card.objects.get(user=user, data__name='Word 2', format__name='Audio').answer, 'word2.mp3')
+        other, other_report, other_num_queries = self.import_scraped('other', 20)
+        self.assertEqual(other_num_queries, num_queries)
+
+
+class CollectionTests(TestCase):
+    def import_lines(self, client, lines):
+        content = '\n'.join(json.dumps(line) for line in lines).encode()
+        return client.post('/api/collection/import/', {
+            'file': SimpleUploadedFile('collection.ndjson', content),
+        }, format='multipart')
+
+    def test_export_and_import(self):
+        user, deck, client = create_collection(num_data=3)
+        response = client.get('/api/collection/export/?compress=gzip')
+        export = b''.join(response.streaming_content)
+        other, other_deck, other_client = create_collection('other', num_data=0)
+        response = other_client.post('/api/collection/import/', {
+            'file': SimpleUploadedFile('collection.ndjson.gz', export),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['card'], 3)
+        self.assertEqual(
+            sorted(card.question for card in models.Card.objects.filter(user=other)),
+            [f'<b>word {i}</b>' for i in range(3)],
+        )
+
+    def test_incomplete_records_are_rejected(self):
+        user, deck, client = create_collection(num_data=0)
+        for record in [{'type': 'card', 'id': 1}, {'type': 'deck', 'name': 'Deck'}, {'type': 'deck', 'id': 1}]:
+            response = self.import_lines(client, [{'type': 'collection', 'version': 1}, record])
+            self.assertEqual(response.status_code, 400, record)
+        response = self.import_lines(client, [
+            {'type': 'deck', 'id': 1, 'name': 'Deck'},
+            {'type': 'data_format', 'id': 1, 'name': 'Words'},
+            {'type': 'card_format', 'id': 1, 'name': 'Meaning', 'question_html': '', 'answer_html': '',
+             'data_format_id': 1},
+            {'type': 'data', 'id': 1, 'name': 'Word', 'format_id': 1},
+            {'type': 'card', 'id': 1, 'format_id': 1, 'data_id': 1, 'total_correct': 'many'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(models.Deck.objects.filter(user=user).count(), 1)
+
+
+class JobTests(TestCase):
+    def run_job(self, job):
+        with mock.patch.object(jobs, 'close_old_connections'), mock.patch.object(jobs.threading, 'Timer') as timer:
+            jobs.run_job(job.id)
+        job.refresh_from_db()
+        return timer
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        user, deck, client = create_collection(num_data=0)
+        statuses = []
+
+        def fail():
+            statuses.append(models.Job.objects.get(kind='fail').status)
+            raise ValueError('Page not found')
+
+        job = models.Job.objects.create(kind='fail', user=user, max_attempts=3)
+        with mock.patch.dict(handlers, fail=fail), override_settings(JOB_RETRY_DELAY=5), \
+                self.assertLogs(jobs.logger, 'ERROR') as logs:
+            for attempt, delay in [(1, 5), (2, 10)]:
+                start = timezone.now()
+                timer = self.run_job(job)
+                self.assertEqual((job.status, job.attempts, job.error), (models.Job.PENDING, attempt, 'Page not found'))
+                self.assertEqual(timer.call_args[0][0], delay)
+                self.assertGreaterEqual(job.run_after, start + timedelta(seconds=delay))
+                self.run_job(job)
+                self.assertEqual(job.attempts, attempt)
+                models.Job.objects.filter(id=job.id).update(run_after=timezone.now())
+            self.run_job(job)
+        self.assertEqual((job.status, job.attempts), (models.Job.FAILED, 3))
+        self.assertEqual(statuses, [models.Job.RUNNING] * 3)
+        self.assertEqual(len(logs.records), 3)
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_stale_running_jobs_are_released(self):
+        user, deck, client = create_collection(num_data=0)
+        stale, lost, running = [
+            models.Job.objects.create(kind='done', user=user, status=models.Job.RUNNING, attempts=1, max_attempts=2),
+            models.Job.objects.create(kind='done', user=user, status=models.Job.RUNNING, attempts=1),
+            models.Job.objects.create(kind='done', user=user, status=models.Job.RUNNING, attempts=1),
+        ]
+        models.Job.objects.filter(id__in=[stale.id, lost.id]).update(updated=timezone.now() - timedelta(minutes=2))
+        with mock.patch.dict(handlers, done=lambda: 'done'), mock.patch.object(jobs, 'close_old_connections'):
+            self.assertEqual(jobs.run_pending(), 1)
+        for job in [stale, lost, running]:
+            job.refresh_from_db()
+        self.assertEqual((stale.status, stale.attempts, stale.result), (models.Job.DONE, 2, 'done'))
+        self.assertEqual(lost.status, models.Job.FAILED)
+        self.assertEqual(running.status, models.Job.RUNNING)
+
+
+class ReviewTests(TestCase):
+    def test_unknown_cards_are_not_found(self):
+        user, deck, client = create_collection()
+        other, other_deck, other_client = create_collection('other')
+        other_card = models.Card.objects.get(user=other)
+        for pk in ['abc', other_card.id, 0]:
+            response = client.post(f'/api/cards/{pk}/correct/', {'study': True}, format='json')
+            self.assertEqual(response.status_code, 404, pk)
+        other_card.refresh_from_db()
+        self.assertIsNone(other_card.last_seen)
+
+    def test_review_times_are_aware(self):
+        user, deck, client = create_collection()
+        card = models.Card.objects.get(user=user)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            response = client.post(f'/api/cards/{card.id}/incorrect/', {'study': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        card.refresh_from_db()
+        self.assertEqual((card.total_wrong, card.current_streak), (1, 0))
+
+
+class ReviewBatchTests(TestCase):
+    def test_reviews_without_preferences(self):
+        user, deck, client = create_collection(num_data=1)
+        models.UserPref.objects.filter(user=user).delete()
+        card = models.Card.objects.get(user=user)
+        response = client.post('/api/cards/review-batch/', [
+            {'card_id': card.id, 'result': 'correct'},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        response = client.post('/api/cards/review-batch/', [
+            {'card_id': card.id, 'result': 'correct', 'study': True},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_studied_reviews_are_scheduled(self):
+        user, deck, client = create_collection(num_data=1, scheduler='SM2')
+        card = models.Card.objects.get(user=user)
+        response = client.post('/api/cards/review-batch/', [
+            {'card_id': card.id, 'result': 'correct', 'study': True},
+            {'card_id': card.id, 'result': 'correct', 'study': True},
+        ], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['current_streak'], 2)
+        card.refresh_from_db()
+        self.assertEqual(card.next_due, (card.last_seen + timedelta(days=6)).date())
+
+
+class OCRModelTests(TestCase):
+    def test_model_is_loaded_once_by_concurrent_requests(self):
+        from flash_cards_api.helpers import ocr
+        loads = []
+
+        def load_model():
+            loads.append(threading.get_ident())
+            time.sleep(0.1)
+            return mock.Mock()
+
+        with mock.patch.object(ocr, 'load_model', load_model), mock.patch.object(ocr, '_model', None), \
+                mock.patch.object(ocr, '_batcher', None):
+            threads = [threading.Thread(target=ocr.get_batcher) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(loads), 1)
+
+    def test_recognition_skips_scikit_learn(self):
+        # Labels are read in a fresh interpreter, as the first submission to a worker would.
+        script = (
+            'import json, sys\n'
+            'import numpy as np\n'
+            'from flash_cards_api.helpers import ocr\n'
+            'results = ocr.get_results(np.array([0.1, 0.7, 0.2, 0.4]), ocr.get_classes(), 3)\n'
+            'print(json.dumps({"results": results, "modules": list(sys.modules)}))\n'
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'labels.json').write_text(json.dumps({'classes': [65, 66, 67], 'counts': [1, 1, 1]}))
+            result = subprocess.run(
+                [sys.executable, '-c', script], capture_output=True, text=True, check=True, cwd=directory,
+                env={**os.environ, 'PYTHONPATH': str(Path(__file__).resolve().parent.parent)},
+            )
+        output = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(output['results'], {'labels': ['B', 'C', 'A'], 'accuracy': [0.7, 0.2, 0.1]})
+        self.assertEqual([name for name in ['sklearn', 'scipy'] if name in output['modules']], [])
+
+
+class FakeDriver:
+    def __init__(self):
+        self.responding = True
+        self.loads_fail = False
+        self.quit_called = False
+        self.urls = []
+
+    @property
+    def current_url(self):
+        if not self.responding:
+            raise ConnectionError('Browser stopped')
+        return self.urls[-1] if self.urls else 'about:blank'
+
+    def get(self, url):
+        if self.loads_fail:
+            raise TimeoutError('Page load timed out')
+        self.urls.append(url)
+
+    def quit(self):
+        self.quit_called = True
+
+
+class BrowserPoolTests(TestCase):
+    def get_pool(self, size=1, max_pages=100):
+        drivers = []
+
+        def factory(page_timeout):
+            drivers.append(FakeDriver())
+            return drivers[-1]
+
+        return BrowserPool(size, max_pages, 30, factory), drivers
+
+    def test_size_is_capped(self):
+        pool, drivers = self.get_pool(size=2)
+        first, second = pool.checkout(), pool.checkout()
+        with self.assertRaises(queue.Empty):
+            pool.checkout(timeout=0.01)
+        self.assertEqual(len(drivers), 2)
+        pool.checkin(first)
+        self.assertIs(pool.checkout(timeout=0.01), first)
+
+    def test_checkout_waits_for_a_driver(self):
+        pool, drivers = self.get_pool()
+        driver = pool.checkout()
+        threading.Timer(0.05, pool.checkin, [driver]).start()
+        self.assertIs(pool.checkout(timeout=5), driver)
+        self.assertEqual(len(drivers), 1)
+
+    def test_drivers_are_recycled(self):
+        pool, drivers = self.get_pool(max_pages=2)
+        for i in range(5):
+            with pool.page(f'http://localhost/{i}'):
+                pass
+        self.assertEqual([len(driver.urls) for driver in drivers], [2, 2, 1])
+        self.assertEqual([driver.quit_called for driver in drivers], [True, True, False])
+
+    def test_unhealthy_drivers_are_replaced(self):
+        pool, drivers = self.get_pool()
+        with pool.page('http://localhost/'):
+            pass
+        drivers[0].responding = False
+        with pool.page('http://localhost/'):
+            pass
+        self.assertEqual(len(drivers), 2)
+        self.assertTrue(drivers[0].quit_called)
+
+    def test_failed_page_loads_replace_the_driver(self):
+        pool, drivers = self.get_pool()
+        with pool.page('http://localhost/'):
+            pass
+        drivers[0].loads_fail = True
+        with self.assertRaises(TimeoutError):
+            with pool.page('http://localhost/'):
+                pass
+        self.assertTrue(drivers[0].quit_called)
+        with pool.page('http://localhost/'):
+            pass
+        self.assertEqual(len(drivers), 2)
+
+    def test_page_errors_keep_the_driver(self):
+        pool, drivers = self.get_pool()
+        for _ in range(3):
+            with self.assertRaises(LookupError):
+                with pool.page('http://localhost/'):
+                    raise LookupError('Missing element')
+        self.assertEqual(len(drivers), 1)
+        self.assertFalse(drivers[0].quit_called)
+        with self.assertRaises(LookupError):
+            with pool.page('http://localhost/') as driver:
+                driver.responding = False
+                raise LookupError('Missing element')
+        self.assertTrue(drivers[0].quit_called)
+
+
+class ScrapeTests(TestCase):
+    fields = [mock.Mock(xpath='//h1')]
+
+    def get_response(self, status_code, text=''):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = text.encode()
+        return response
+
+    def scrape(self, response, backend):
+        from flash_cards_api.helpers import scraping
+        with mock.patch.object(http.get_session(), 'get', return_value=response), \
+                mock.patch.object(scraping, 'scrape_browser', return_value={'from': 'browser'}) as browser:
+            return scraping.scrape('https://example.com', self.fields, backend), browser.called
+
+    def test_static_pages_are_not_opened_in_a_browser(self):
+        values, used_browser = self.scrape(self.get_response(200, '<h1>Word</h1>'), 'AUTO')
+        self.assertEqual(values, {self.fields[0]: '<h1>Word</h1>'})
+        self.assertFalse(used_browser)
+
+    def test_auto_falls_back_to_a_browser(self):
+        for response in [self.get_response(200, '<p>Word</p>'), self.get_response(403), self.get_response(429)]:
+            self.assertEqual(self.scrape(response, 'AUTO'), ({'from': 'browser'}, True))
+
+    def test_http_backend_does_not_fall_back(self):
+        with self.assertRaises(requests.HTTPError):
+            self.scrape(self.get_response(403), 'HTTP')
+        with self.assertRaises(http.MissingElement):
+            self.scrape(self.get_response(200, '<p>Word</p>'), 'HTTP')
+
+
+class ScrapeCacheTests(TestCase):
+    def get_fields(self, username):
+        user, deck, client = create_collection(username, num_data=0)
+        data_format = models.DataFormat.objects.get(user=user)
+        return [
+            models.Field.objects.create(name='audio', data_format=data_format, xpath='//audio/@src'),
+            models.Field.objects.create(name='title', data_format=data_format, xpath='//h1'),
+        ]
+
+    def test_entries_are_shared_across_formats(self):
+        audio, title = self.get_fields('user')
+        other_title, other_audio = reversed(self.get_fields('other'))
+        scrape_cache.store_values('https://example.com/word', {audio: 'word.mp3', title: '<h1>Word</h1>'})
+        self.assertEqual(
+            scrape_cache.get_values('https://example.com/word', [other_title, other_audio]),
+            {other_title: '<h1>Word</h1>', other_audio: 'word.mp3'},
+        )
+        self.assertIsNone(scrape_cache.get_values('https://example.com/word', [other_audio]))
+        self.assertIsNone(scrape_cache.get_values('https://example.com/other', [other_audio, other_title]))
+        self.assertEqual(scrape_cache.get_stats(), {'entries': 1, 'hits': 1, 'misses': 1})
+
+    def test_hits_and_misses_are_counted(self):
+        audio, title = self.get_fields('user')
+        scrape_cache.store_values('https://example.com/word', {audio: 'word.mp3'})
+        scrape_cache.store_values('https://example.com/word', {audio: 'word2.mp3'})
+        for _ in range(3):
+            self.assertEqual(scrape_cache.get_values('https://example.com/word', [audio]), {audio: 'word2.mp3'})
+        urls = ['https://example.com/word', 'https://example.com/word', 'https://example.com/other']
+        self.assertEqual(scrape_cache.get_values_many(urls, [audio]), {urls[0]: {audio: 'word2.mp3'}})
+        self.assertEqual(scrape_cache.get_stats(), {'entries': 1, 'hits': 5, 'misses': 2})
+
+    @override_settings(SCRAPE_CACHE_TIMEOUT=60)
+    def test_entries_expire(self):
+        audio, title = self.get_fields('user')
+        scrape_cache.store_values('https://example.com/old', {audio: 'old.mp3'})
+        scrape_cache.store_values('https://example.com/new', {audio: 'new.mp3'})
+        models.ScrapeResult.objects.filter(url='https://example.com/old') \
+            .update(created=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(scrape_cache.get_values('https://example.com/old', [audio]))
+        self.assertEqual(scrape_cache.get_values('https://example.com/new', [audio]), {audio: 'new.mp3'})
+        scrape_cache.evict()
+        self.assertEqual(list(models.ScrapeResult.objects.values_list('url', flat=True)), ['https://example.com/new'])
+        with override_settings(SCRAPE_CACHE_TIMEOUT=0):
+            scrape_cache.store_values('https://example.com/off', {audio: 'off.mp3'})
+            self.assertIsNone(scrape_cache.get_values('https://example.com/new', [audio]))
+        self.assertFalse(models.ScrapeResult.objects.filter(url='https://example.com/off').exists())
+
+    @override_settings(SCRAPE_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        audio, title = self.get_fields('user')
+        for i in range(2):
+            scrape_cache.store_values(f'https://example.com/{i}', {audio: f'{i}.mp3'})
+        models.ScrapeResult.objects.filter(url='https://example.com/0') \
+            .update(last_used=timezone.now() - timedelta(minutes=2))
+        models.ScrapeResult.objects.filter(url='https://example.com/1') \
+            .update(last_used=timezone.now() - timedelta(minutes=1))
+        self.assertIsNotNone(scrape_cache.get_values('https://example.com/0', [audio]))
+        scrape_cache.store_values('https://example.com/2', {audio: '2.mp3'})
+        self.assertEqual(
+            sorted(models.ScrapeResult.objects.values_list('url', flat=True)),
+            ['https://example.com/0', 'https://example.com/2'],
+        )
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    pages = {
+        '/words/word.html': (
+            '<html><head><title>Word</title></head><body>\n'
+            '<h1 class="title">Word <small>noun</small></h1>\n'
+            '<p id="meaning">A <b>unit</b> of language &amp; meaning.</p>\n'
+            '<a id="next" href="next.html">Next</a>\n'
+            '<a id="home" href="/index.html">Home</a>\n'
+            '<a id="other" href="https://example.com/word">Other</a>\n'
+            '<audio src="../audio/word.mp3" data-speaker="Ann"></audio>\n'
+            '<img src="//cdn.example.com/word.png">\n'
+            '</body></html>\n'
+        ),
+    }
+
+    def do_GET(self):
+        page = self.pages.get(self.path)
+        self.send_response(200 if page else 404)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.wfile.write((page or 'Not found').encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPScrapeTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/words/word.html'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def scrape(self, *xpaths):
+        fields = [mock.Mock(xpath=xpath) for xpath in xpaths]
+        values = http.scrape(self.url, fields)
+        return [values[field] for field in fields]
+
+    def test_links_are_absolute(self):
+        # Browsers, and so selenium.get_value, report link attributes resolved against the page URL.
+        root = self.url.rsplit('/words/', 1)[0]
+        self.assertEqual(
+            self.scrape('//a[@id="next"]/@href', '//a[@id="home"]/@href', '//a[@id="other"]/@href',
+                        '//audio/@src', '//img/@src'),
+            [f'{root}/words/next.html', f'{root}/index.html', 'https://example.com/word', f'{root}/audio/word.mp3',
+             'http://cdn.example.com/word.png'],
+        )
+
+    def test_other_attributes_are_unchanged(self):
+        self.assertEqual(self.scrape('//audio/@data-speaker', '//h1/@class', '//audio/@title'), ['Ann', 'title', None])
+
+    def test_elements_are_returned_as_outer_html(self):
+        self.assertEqual(
+            self.scrape('//h1', '//p[@id="meaning"]'),
+            [
+                '<h1 class="title">Word <small>noun</small></h1>',
+                '<p id="meaning">A <b>unit</b> of language &amp; meaning.</p>',
+            ],
+        )
+
+    def test_missing_elements_and_pages_raise(self):
+        with self.assertRaises(http.MissingElement):
+            self.scrape('//h1', '//h2')
+        with self.assertRaises(requests.HTTPError):
+            http.scrape(self.url.replace('word.html', 'missing.html'), [mock.Mock(xpath='//h1')])
+
+
+class TextTests(TestCase):
+    def parse(self, html_text):
+        extractor = html.TextExtractor()
+        extractor.feed(html_text)
+        extractor.close()
+        return ''.join(extractor.parts)
+
+    def test_text_matches_the_parser(self):
+        for html_text in ['<b>word</b>', '<b class="a>b">word</b>', '</ b>', 'a</>b', '<b>&amp;</b> &', '&<b>amp;',
+                          '<b<b>word</b>', 'a < b', '<b"<b class="a>">word', '<!-- word -->', '<script>x</script>']:
+            html.get_text.cache_clear()
+            self.assertEqual(html.get_text(html_text), self.parse(html_text), html_text)
+
+
+class ConcurrentReviewTests(TransactionTestCase):
+    num_threads = 8
+    reviews_per_thread = 5
+
+    def test_concurrent_answers_are_not_lost(self):
+        user, deck, client = create_collection()
+        card = models.Card.objects.get(user=user)
+        statuses = []
+
+        def answer():
+            thread_client = APIClient()
+            thread_client.force_authenticate(user)
+            try:
+                for _ in range(self.reviews_per_thread):
+                    response = thread_client.post(f'/api/cards/{card.id}/correct/', {'study': True}, format='json')
+                    statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=answer) for _ in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        num_reviews = self.num_threads * self.reviews_per_thread
+        self.assertEqual(statuses, [200] * num_reviews)
+        card.refresh_from_db()
+        self.assertEqual(card.total_correct, num_reviews)
+        self.assertEqual(card.current_streak, num_reviews)
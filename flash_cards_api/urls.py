@@ -9,6 +9,8 @@ router.register('data-formats', views.DataFormatViewSet, basename='dataformat')
 router.register('card-formats', views.CardFormatViewSet, basename='cardformat')
 router.register('data', views.DataViewSet, basename='data')
 router.register('cards', views.CardViewSet, basename='card')
+router.register('jobs', views.JobViewSet, basename='job')
+router.register('collection', views.CollectionViewSet, basename='collection')
 
 urlpatterns = [
     path('', include(router.urls)),
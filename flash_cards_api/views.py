@@ -1,16 +1,29 @@
-from datetime import datetime
+import hashlib
+from datetime import date
 
-from django.db.models import Prefetch, Count, Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 
 from flash_cards_api import models, serializers
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 
+from flash_cards_api.helpers import collection, importing
+from flash_cards_api.helpers.due import get_due_counts, bump_due_count
+from flash_cards_api.helpers.html import normalize_text
+from flash_cards_api.helpers.pagination import wants_field
 from flash_cards_api.helpers.submit import submit
 
 
 minimum_accuracy = 0.1
+default_queue_size = 20
+max_queue_size = 100
 
 
 class UserCreateViewSet(viewsets.ModelViewSet):
@@ -23,27 +36,72 @@ class DeckViewSet(UserCreateViewSet):
     serializer_class = serializers.DeckSerializer
 
     def get_queryset(self):
-        return models.Deck.objects.filter(user=self.request.user).annotate(num_due=Count('card', filter=(Q(card__last_correct__lt=datetime.now()) | Q(card__last_correct__isnull=True))))
+        queryset = models.Deck.objects.filter(user=self.request.user)
+        if self.action == 'retrieve':
+            # The cards of a deck are loaded in a fixed number of queries however many there are.
+            cards = models.Card.objects.select_related('format', 'data')
+            if not self.is_summary():
+                cards = cards.select_related('rendered').prefetch_related(
+                    Prefetch('data__field_value_set', queryset=models.FieldValue.objects.select_related('field'))
+                )
+            queryset = queryset.prefetch_related(Prefetch('card_set', queryset=cards))
+        return queryset
+
+    def is_summary(self):
+        return self.request.query_params.get('summary', '').lower() not in ('', '0', 'false')
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        decks = list(page if page is not None else queryset)
+        context = self.get_serializer_context()
+        if wants_field(request, 'num_due'):
+            context['due_counts'] = get_due_counts(decks)
+        serializer = self.get_serializer(decks, many=True, context=context)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        serializer = serializers.DeckDetailSerializer(instance)
+        if self.is_summary():
+            serializer = serializers.DeckSummarySerializer(instance)
+        else:
+            serializer = serializers.DeckDetailSerializer(instance)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def quiz(self, request, *args, **kwargs):
         instance = self.get_object()
-        cards = instance.due_cards
-        if cards.count() > 0:
-            serializer = serializers.CardQuizSerializer(cards.first())
+        card = instance.due_cards.select_related('format', 'data', 'rendered').first()
+        if card:
+            serializer = serializers.CardQuizSerializer(card)
             return Response(serializer.data)
         else:
             return Response('', status=204)
 
+    @action(detail=True, methods=['get'])
+    def queue(self, request, *args, **kwargs):
+        instance = self.get_object()
+        try:
+            size = min(int(request.query_params.get('size', default_queue_size)), max_queue_size)
+        except ValueError:
+            raise ValidationError({'size': ['A valid integer is required.']})
+        cards = list(instance.due_cards.select_related('format', 'data', 'rendered')[:max(size, 0)])
+        version = hashlib.sha1(repr([
+            (card.id, card.next_due, card.last_seen, card.format_id, card.question, card.answer)
+            for card in cards
+        ]).encode()).hexdigest()
+        etag = f'"{version}"'
+        if request.headers.get('If-None-Match') == etag:
+            return Response(status=304, headers={'ETag': etag})
+        serializer = serializers.CardQuizSerializer(cards, many=True)
+        return Response({'version': version, 'cards': serializer.data}, headers={'ETag': etag})
+
     @action(detail=True, methods=['get'])
     def study(self, request, *args, **kwargs):
         instance = self.get_object()
-        card = instance.card_set.order_by('last_correct').first()
+        card = instance.card_set.select_related('format', 'data', 'rendered').order_by('last_correct', 'id').first()
         serializer = serializers.CardQuizSerializer(card)
         return Response(serializer.data)
 
@@ -68,58 +126,133 @@ class DataViewSet(UserCreateViewSet):
     serializer_class = serializers.DataSerializer
 
     def get_queryset(self):
-        return models.Data.objects.filter(user=self.request.user).prefetch_related(
-            Prefetch('field_value_set',
-                     queryset=models.FieldValue.objects.select_related('field'))
-        )
+        queryset = models.Data.objects.filter(user=self.request.user)
+        if wants_field(self.request, 'field_value_set'):
+            queryset = queryset.prefetch_related(
+                Prefetch('field_value_set',
+                         queryset=models.FieldValue.objects.select_related('field'))
+            )
+        return queryset
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request, *args, **kwargs):
+        # Takes {"data_format": id, "rows": [{"name": ..., field name: value}]} as JSON, or a data_format and a
+        # CSV or TSV file with a header row of field names as a multipart upload.
+        serializer = serializers.DataImportSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data_format = serializer.validated_data['data_format']
+        file = serializer.validated_data.get('file')
+        try:
+            if file:
+                columns, rows = importing.read_csv(file, importing.get_delimiter(file))
+            else:
+                columns, rows = None, serializer.validated_data.get('rows', [])
+            report = importing.import_data(data_format, request.user, rows, columns)
+        except importing.DataImportError as e:
+            raise ValidationError({'rows': [str(e)]})
+        return Response(report, status=status.HTTP_201_CREATED)
 
 
 class CardViewSet(UserCreateViewSet):
     serializer_class = serializers.CardSerializer
 
     def get_queryset(self):
-        return models.Card.objects.filter(user=self.request.user) \
-            .select_related('data').select_related('format') \
-            .prefetch_related(Prefetch('data__field_value_set',
-                                       queryset=models.FieldValue.objects.select_related('field')))
+        queryset = models.Card.objects.filter(user=self.request.user)
+        # Related rows are only loaded for the fields of the response that read them.
+        if wants_field(self.request, 'name', 'question', 'answer'):
+            queryset = queryset.select_related('data').select_related('format')
+        if wants_field(self.request, 'question', 'answer'):
+            queryset = queryset.select_related('rendered') \
+                .prefetch_related(Prefetch('data__field_value_set',
+                                           queryset=models.FieldValue.objects.select_related('field')))
+        return queryset
 
-    @action(detail=True, methods=['post'])
-    def correct(self, request, *args, **kwargs):
-        instance = self.get_object()
-        now = datetime.now()
-        instance.last_seen = now
-        instance.last_correct = now
-        if request.data.get('study'):
-            instance.total_correct += 1
-            instance.current_streak += 1
-            instance.calculate_next_due()
-        instance.save()
+    def record_review(self, request, pk, correct):
+        # Counters are updated in SQL so concurrent answers for the same card are not lost.
+        now = timezone.now()
+        updates = {'last_seen': now}
+        if correct:
+            updates['last_correct'] = now
+        study = request.data.get('study')
+        if study and correct:
+            updates['total_correct'] = F('total_correct') + 1
+            updates['current_streak'] = F('current_streak') + 1
+        elif study:
+            updates['total_wrong'] = F('total_wrong') + 1
+            updates['current_streak'] = 0
+        previous = get_object_or_404(models.Card.objects.filter(user=request.user).only('next_due'), pk=pk)
+        previous_next_due = previous.next_due
+        cards = models.Card.objects.filter(pk=previous.pk)
+        with transaction.atomic():
+            # Updating first takes the row lock before the card is read back to schedule it.
+            cards.update(**updates)
+            instance = cards.select_related('user__pref', 'format', 'data', 'rendered').get()
+            if study:
+                instance.calculate_next_due()
+                instance.save(update_fields=['next_due'])
+        today = date.today()
+        bump_due_count(instance.deck_id, (instance.next_due <= today) - (previous_next_due <= today))
         return Response(self.serializer_class(instance).data)
 
     @action(detail=True, methods=['post'])
-    def incorrect(self, request, *args, **kwargs):
-        instance = self.get_object()
-        instance.last_seen = datetime.now()
-        if request.data.get('study'):
-            instance.total_wrong += 1
-            instance.current_streak = 0
-            instance.calculate_next_due()
-        instance.save()
-        return Response(self.serializer_class(instance).data)
+    def correct(self, request, pk=None, *args, **kwargs):
+        return self.record_review(request, pk, True)
+
+    @action(detail=True, methods=['post'])
+    def incorrect(self, request, pk=None, *args, **kwargs):
+        return self.record_review(request, pk, False)
+
+    @action(detail=False, methods=['post'], url_path='review-batch')
+    def review_batch(self, request, *args, **kwargs):
+        serializer = serializers.ReviewSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        now = timezone.now()
+        reviews = sorted(serializer.validated_data, key=lambda review: review.get('timestamp', now))
+        card_ids = {review['card_id'] for review in reviews}
+        # The preference is only needed to schedule studied reviews.
+        pref = None
+        if any(review['study'] for review in reviews):
+            pref = models.UserPref.objects.filter(user=request.user).first()
+            if pref is None:
+                raise ValidationError({'study': ['Set up your preferences before studying.']})
+        with transaction.atomic():
+            cards = models.Card.objects.filter(user=request.user).select_for_update().in_bulk(card_ids)
+            missing = card_ids - cards.keys()
+            if missing:
+                raise ValidationError({'card_id': [f'Card {card_id} does not exist.' for card_id in sorted(missing)]})
+            today = date.today()
+            was_due = {card.id: card.next_due <= today for card in cards.values()}
+            for review in reviews:
+                cards[review['card_id']].record_result(
+                    review['result'] == 'correct',
+                    review['study'],
+                    review.get('timestamp', now),
+                    pref,
+                )
+            models.Card.objects.bulk_update(cards.values(), [
+                'last_seen', 'last_correct', 'next_due', 'total_correct', 'total_wrong', 'current_streak'
+            ])
+        for card in cards.values():
+            bump_due_count(card.deck_id, (card.next_due <= today) - was_due[card.id])
+        return Response(serializers.ReviewResultSerializer(cards.values(), many=True).data)
 
     @action(detail=True, methods=['post'])
     def check_written(self, request, *args, **kwargs):
         instance = self.get_object()
         image = request.data.get('image')
-        data = submit(image)
+        try:
+            data = submit(image)
+        except (TypeError, ValueError):
+            raise ValidationError({'image': ['Could not read the image.']})
+        expected = instance.answer_text
         response = {
             'data': data,
             'correct': True
         }
-        if len(data) != len(instance.answer_text):
+        if len(data) != len(expected):
             response['correct'] = False
         else:
-            for i, char in enumerate(instance.answer_text):
+            for i, char in enumerate(expected):
                 if char not in data[i]['labels']:
                     response['correct'] = False
                 else:
@@ -132,8 +265,44 @@ class CardViewSet(UserCreateViewSet):
     def check_typed(self, request, *args, **kwargs):
         instance = self.get_object()
         answer = request.data.get('answer')
+        if getattr(settings, 'NORMALIZE_ANSWERS', False):
+            correct = isinstance(answer, str) and normalize_text(answer) == instance.normalized_answer
+        else:
+            correct = answer == instance.answer_text
         data = {
-            'correct': answer == instance.answer_text,
+            'correct': correct,
             'answer': answer
         }
         return Response(data)
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = serializers.JobSerializer
+
+    def get_queryset(self):
+        return models.Job.objects.filter(user=self.request.user)
+
+
+class CollectionViewSet(viewsets.ViewSet):
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        # Streams the collection as NDJSON, gzipped when ?compress=gzip is passed.
+        lines = collection.export_collection(request.user)
+        if request.query_params.get('compress') == 'gzip':
+            response = StreamingHttpResponse(collection.compress(lines), content_type='application/gzip')
+            response['Content-Disposition'] = 'attachment; filename="collection.ndjson.gz"'
+        else:
+            response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+            response['Content-Disposition'] = 'attachment; filename="collection.ndjson"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_collection(self, request, *args, **kwargs):
+        file = request.data.get('file')
+        if not file:
+            raise ValidationError({'file': ['An exported collection is required.']})
+        try:
+            counts = collection.import_collection(request.user, collection.read_lines(file))
+        except (collection.CollectionImportError, OSError, UnicodeDecodeError) as e:
+            raise ValidationError({'file': [str(e)]})
+        return Response(counts, status=status.HTTP_201_CREATED)
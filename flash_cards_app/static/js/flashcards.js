@@ -63,4 +63,37 @@ function sendPatch(path, data, callback, errorHandle) {
             success: callback
         });
     }
-}
\ No newline at end of file
+}
+
+const cardQueueSize = 20;
+
+function getQueuedCard(deckId, callback) {
+    // Due cards are kept in session storage with the version the server gave them. Every load sends that
+    // version, so the server only sends the cards again when they changed, such as after an answer in another
+    // tab or in study mode. The callback gets null when nothing is due.
+    const key = "card-queue-" + deckId;
+    let queue = JSON.parse(sessionStorage.getItem(key) || '{"version": null, "cards": []}');
+    $.ajax(
+    {
+        type: "GET",
+        dataType: "json",
+        url: "/api/decks/" + deckId + "/queue/?size=" + cardQueueSize,
+        headers: queue.version ? {"If-None-Match": '"' + queue.version + '"'} : {},
+        error: defaultErrorHandle,
+        success: function(data, status, xhr) {
+            if (xhr.status === 200) {
+                queue = {version: data.version, cards: data.cards};
+            }
+            sessionStorage.setItem(key, JSON.stringify(queue));
+            callback(queue.cards[0] || null);
+        }
+    });
+}
+
+function removeQueuedCard(deckId, cardId) {
+    const key = "card-queue-" + deckId;
+    // The stored version no longer matches once a card is answered, so the next load gets the new queue.
+    let queue = JSON.parse(sessionStorage.getItem(key) || '{"version": null, "cards": []}');
+    queue.cards = queue.cards.filter((card) => card.id !== cardId);
+    sessionStorage.setItem(key, JSON.stringify(queue));
+}
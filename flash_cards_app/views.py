@@ -30,7 +30,7 @@ def deck_edit(request, deck_id):
 def deck_quiz(request, deck_id):
     deck = get_object_or_404(models.Deck, pk=deck_id)
     serializer = serializers.DeckSerializer(deck)
-    if deck.due_cards.count() > 0:
+    if deck.due_cards.exists():
         return render(request, 'deck/quiz.html', context=serializer.data)
     else:
         return redirect('/app/decks')
@@ -89,7 +89,7 @@ def card_format_edit(request, card_format_id):
 
 @login_required
 def card_front(request, card_id):
-    card = get_object_or_404(models.Card, pk=card_id)
+    card = get_object_or_404(models.Card.objects.select_related('format', 'data', 'rendered'), pk=card_id)
     serializer = serializers.CardSerializer(card)
     response = TemplateResponse(request, 'card/front.html', context=serializer.data)
     return response
@@ -97,7 +97,7 @@ def card_front(request, card_id):
 
 @login_required
 def card_back(request, card_id):
-    card = get_object_or_404(models.Card, pk=card_id)
+    card = get_object_or_404(models.Card.objects.select_related('format', 'data', 'rendered'), pk=card_id)
     serializer = serializers.CardSerializer(card)
     response = TemplateResponse(request, 'card/back.html', context=serializer.data)
     return response
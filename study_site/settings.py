@@ -82,6 +82,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Tests use a file rather than shared in-memory SQLite, whose table locks fail concurrent writers at once
+        # instead of waiting.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -135,8 +138,42 @@ REST_FRAMEWORK = {
             'rest_framework.parsers.FormParser',
             'rest_framework.parsers.MultiPartParser',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'flash_cards_api.helpers.pagination.OptionalCursorPagination',
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
 
 LOGIN_REDIRECT_URL = '/app/decks/'
+
+# Flash card settings
+CARD_TEMPLATE_CACHE_SIZE = 512
+DEFER_CARD_FAN_OUT = False
+# Card format edits affecting more cards than this are re-rendered by a background job.
+RENDER_INLINE_LIMIT = 1000
+JOB_WORKERS = 1
+# Seconds before the first retry of a failed job, doubled on each further attempt.
+JOB_RETRY_DELAY = 5
+# Seconds after which a running job is taken to be lost with its worker and is run again by run_jobs.
+JOB_TIMEOUT = 60 * 60
+# Seconds to cache per-deck due counts for, 0 disables the cache.
+DUE_COUNT_CACHE_TIMEOUT = 0
+# Longest interval in days any scheduler may put between reviews.
+SCHEDULER_MAX_INTERVAL = 36500
+# Character crops are batched across requests for up to this many crops or seconds.
+OCR_MAX_BATCH_SIZE = 64
+OCR_MAX_BATCH_DELAY = 0.005
+# 'keras' serves ocr.keras, 'tflite' serves the quantized export written by the train command.
+OCR_BACKEND = 'keras'
+OCR_TFLITE_MODEL = 'ocr.tflite'
+# Headless browsers kept open for scraping, recycled after SCRAPER_MAX_PAGES pages.
+SCRAPER_BROWSERS = 2
+SCRAPER_MAX_PAGES = 100
+SCRAPER_PAGE_TIMEOUT = 30
+SCRAPE_MAX_ATTEMPTS = 3
+SCRAPER_HTTP_TIMEOUT = 10
+SCRAPER_HTTP_POOL_SIZE = 10
+# Seconds scraped values are reused for pages with the same URL and xpaths, 0 disables the cache.
+SCRAPE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+SCRAPE_CACHE_MAX_ENTRIES = 10000
+# Compare typed answers ignoring case, whitespace and unicode forms, storing the normalized answer when rendering.
+NORMALIZE_ANSWERS = False